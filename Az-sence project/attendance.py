@@ -0,0 +1,135 @@
+import csv
+import datetime
+import logging
+import os
+import threading
+from perf_stats import stages
+
+TIMESTAMP_FORMAT = "%Y-%m-%d %H:%M:%S"
+
+log = logging.getLogger(__name__)
+
+
+class AttendanceSink:
+    """Debounced, buffered attendance writer
+
+    record() only checks the per-person cooldown and appends to an in-memory
+    buffer, so it is cheap enough to call for every recognition. A background
+    thread flushes the buffer to attendance/attendance_<date>.csv when it
+    reaches flush_size rows, every flush_interval seconds, and on close().
+    Given a repository, the rows are also queued for its writer thread,
+    which owns the database's only write connection.
+
+    Rows whose CSV write fails go back to the buffer for the next flush;
+    failures are counted as attendance_failures.
+    """
+
+    def __init__(self, directory="attendance", cooldown=300.0, flush_size=50,
+                 flush_interval=5.0, write_csv=True, repository=None):
+        self.directory = directory
+        self.repository = repository
+        self.cooldown = datetime.timedelta(seconds=cooldown)
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+        self.write_csv = write_csv
+        self.last_recorded = {}
+        self.written = 0
+        self._buffer = []
+        self._lock = threading.Lock()
+        self._write_lock = threading.Lock()
+        self._wake = threading.Event()
+        self._closed = threading.Event()
+        self._thread = None
+        self._load_today()
+
+    def start(self):
+        self._thread = threading.Thread(target=self._flush_loop, name="attendance", daemon=True)
+        self._thread.start()
+        return self
+
+    def record(self, name, when=None):
+        """Buffer an attendance row unless name was recorded within the cooldown"""
+        when = when or datetime.datetime.now()
+        with self._lock:
+            last = self.last_recorded.get(name)
+            if last is not None and when - last < self.cooldown:
+                return False
+            self.last_recorded[name] = when
+            self._buffer.append((name, when))
+            full = len(self._buffer) >= self.flush_size
+        if full:
+            self._wake.set()
+        return True
+
+    def flush(self):
+        """Write every buffered row now"""
+        with self._lock:
+            rows, self._buffer = self._buffer, []
+        if not rows:
+            return
+        with self._write_lock, stages.measure("attendance_flush"):
+            if self.write_csv:
+                try:
+                    self._write_csv(rows)
+                except Exception:
+                    with self._lock:
+                        self._buffer[:0] = rows
+                    raise
+            if self.repository is not None:
+                self.repository.add_attendance(self._db_rows(rows)).add_done_callback(self._db_written)
+            self.written += len(rows)
+
+    def close(self):
+        self._closed.set()
+        self._wake.set()
+        if self._thread is not None:
+            self._thread.join(timeout=5.0)
+        self.flush()
+
+    def _flush_loop(self):
+        while not self._closed.is_set():
+            self._wake.wait(self.flush_interval)
+            self._wake.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                stages.count("attendance_failures")
+                log.warning("Failed to write attendance: %s", e)
+
+    def _write_csv(self, rows):
+        if not os.path.exists(self.directory):
+            os.makedirs(self.directory)
+        by_date = {}
+        for name, when in rows:
+            by_date.setdefault(when.strftime("%Y-%m-%d"), []).append([name, when.strftime(TIMESTAMP_FORMAT)])
+        for date, date_rows in by_date.items():
+            filename = self.csv_path(date)
+            file_exists = os.path.isfile(filename)
+            with open(filename, mode="a", newline="") as file:
+                writer = csv.writer(file)
+                if not file_exists:
+                    writer.writerow(["Name", "Timestamp"])
+                writer.writerows(date_rows)
+
+    def _db_written(self, future):
+        if future.exception() is not None:
+            stages.count("attendance_failures")
+            log.warning("Failed to write attendance rows: %s", future.exception())
+
+    def _db_rows(self, rows):
+        return [(name, when.strftime(TIMESTAMP_FORMAT), when.strftime("%Y-%m-%d")) for name, when in rows]
+
+    def csv_path(self, date):
+        return os.path.join(self.directory, f"attendance_{date}.csv")
+
+    def _load_today(self):
+        """Seed the cooldown from today's file so a restart does not log everyone again"""
+        filename = self.csv_path(datetime.datetime.now().strftime("%Y-%m-%d"))
+        if not os.path.isfile(filename):
+            return
+        try:
+            with open(filename, newline="") as file:
+                for row in csv.DictReader(file):
+                    self.last_recorded[row["Name"]] = datetime.datetime.strptime(row["Timestamp"], TIMESTAMP_FORMAT)
+        except (OSError, KeyError, ValueError):
+            pass
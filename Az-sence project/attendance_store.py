@@ -0,0 +1,194 @@
+"""Indexed store of the daily attendance CSVs for fast range and per-person reports
+
+    python attendance_store.py present --from 2025-03-01 --to 2025-03-31
+    python attendance_store.py hours --from 2025-01-01 --to 2025-03-31
+    python attendance_store.py person "aahmed yasser" --from 2025-04-01
+
+The CSVs written by AttendanceSink stay the record; this store is derived
+from them. Every query first ingests what was appended since the last one:
+the byte offset reached in each file is remembered, so only new rows are
+parsed, and a file that shrank is read again from the start.
+"""
+import argparse
+import csv
+import glob
+import io
+import os
+import sqlite3
+import sys
+import time
+
+INDEX_NAME = "attendance_index.db"
+
+
+class AttendanceStore:
+    """SQLite index of attendance events with the ingest offset of every CSV"""
+
+    def __init__(self, directory="attendance", db_path=None):
+        self.directory = directory
+        self.db_path = db_path or os.path.join(directory, INDEX_NAME)
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        self.conn = sqlite3.connect(self.db_path)
+        self.conn.execute("PRAGMA journal_mode = WAL")
+        with self.conn:
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS files (
+                    path TEXT PRIMARY KEY,
+                    offset INTEGER NOT NULL
+                )
+            """)
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS events (
+                    id INTEGER PRIMARY KEY,
+                    file TEXT NOT NULL,
+                    name TEXT NOT NULL,
+                    timestamp TEXT NOT NULL,
+                    day TEXT NOT NULL
+                )
+            """)
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_events_day ON events (day, name)")
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_events_file ON events (file)")
+            # One row per person per day, so reports over years scan days rather than events
+            self.conn.execute("""
+                CREATE TABLE IF NOT EXISTS days (
+                    name TEXT NOT NULL,
+                    day TEXT NOT NULL,
+                    first_seen TEXT NOT NULL,
+                    last_seen TEXT NOT NULL,
+                    hours REAL NOT NULL,
+                    events INTEGER NOT NULL,
+                    PRIMARY KEY (name, day)
+                )
+            """)
+            self.conn.execute("CREATE INDEX IF NOT EXISTS idx_days_day ON days (day)")
+
+    def close(self):
+        self.conn.close()
+
+    def ingest(self):
+        """Read the rows appended to every daily CSV since the last ingest, returns the count"""
+        offsets = dict(self.conn.execute("SELECT path, offset FROM files"))
+        added = 0
+        touched = set()
+        with self.conn:
+            for path in sorted(glob.glob(os.path.join(self.directory, "attendance_*.csv"))):
+                key = os.path.basename(path)
+                offset = offsets.get(key, 0)
+                size = os.path.getsize(path)
+                if size == offset:
+                    continue
+                if size < offset:
+                    # Rewritten or truncated: forget its rows and read it again
+                    touched.update(row[0] for row in self.conn.execute(
+                        "SELECT DISTINCT day FROM events WHERE file = ?", (key,)))
+                    self.conn.execute("DELETE FROM events WHERE file = ?", (key,))
+                    offset = 0
+                rows, offset = self._read_from(path, offset)
+                touched.update(timestamp[:10] for _, timestamp in rows)
+                self.conn.executemany("INSERT INTO events (file, name, timestamp, day) VALUES (?, ?, ?, ?)",
+                                      [(key, name, timestamp, timestamp[:10]) for name, timestamp in rows])
+                self.conn.execute("INSERT OR REPLACE INTO files (path, offset) VALUES (?, ?)", (key, offset))
+                added += len(rows)
+            for day in touched:
+                self.conn.execute("DELETE FROM days WHERE day = ?", (day,))
+                self.conn.execute("""
+                    INSERT INTO days (name, day, first_seen, last_seen, hours, events)
+                    SELECT name, day, MIN(timestamp), MAX(timestamp),
+                           24.0 * (julianday(MAX(timestamp)) - julianday(MIN(timestamp))), COUNT(*)
+                    FROM events WHERE day = ? GROUP BY name
+                """, (day,))
+        return added
+
+    def _read_from(self, path, offset):
+        """Complete rows after offset, and the offset just past the last complete line"""
+        with open(path, "rb") as f:
+            f.seek(offset)
+            data = f.read()
+        end = data.rfind(b"\n") + 1  # a line still being written is left for next time
+        rows = []
+        for row in csv.reader(io.StringIO(data[:end].decode("utf-8", errors="replace"))):
+            if len(row) < 2 or row[0] == "Name":
+                continue
+            rows.append((row[0], row[1]))
+        return rows, offset + end
+
+    def present(self, start, end):
+        """(name, days present, first seen, last seen, events) for every person in [start, end]"""
+        self.ingest()
+        return self.conn.execute("""
+            SELECT name, COUNT(*), MIN(first_seen), MAX(last_seen), SUM(events)
+            FROM days WHERE day BETWEEN ? AND ?
+            GROUP BY name ORDER BY name
+        """, (start, end)).fetchall()
+
+    def hours(self, start, end):
+        """(name, days, hours) per person, a day lasting from first to last sighting"""
+        self.ingest()
+        return self.conn.execute("""
+            SELECT name, COUNT(*), ROUND(SUM(hours), 2)
+            FROM days WHERE day BETWEEN ? AND ?
+            GROUP BY name ORDER BY name
+        """, (start, end)).fetchall()
+
+    def person(self, name, start, end):
+        """(day, first seen, last seen, hours, events) for one person in [start, end]"""
+        self.ingest()
+        return self.conn.execute("""
+            SELECT day, first_seen, last_seen, ROUND(hours, 2), events
+            FROM days WHERE name = ? AND day BETWEEN ? AND ?
+            ORDER BY day
+        """, (name, start, end)).fetchall()
+
+    def daily(self, start, end):
+        """(day, people present, events) for every day in [start, end] with attendance"""
+        self.ingest()
+        return self.conn.execute("""
+            SELECT day, COUNT(*), SUM(events)
+            FROM days WHERE day BETWEEN ? AND ?
+            GROUP BY day ORDER BY day
+        """, (start, end)).fetchall()
+
+
+REPORTS = {
+    "present": (["Name", "Days", "First seen", "Last seen", "Events"], AttendanceStore.present),
+    "hours": (["Name", "Days", "Hours"], AttendanceStore.hours),
+    "daily": (["Day", "People", "Events"], AttendanceStore.daily),
+    "person": (["Day", "First seen", "Last seen", "Hours", "Events"], AttendanceStore.person),
+}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Attendance reports over the daily CSVs")
+    parser.add_argument("report", choices=sorted(REPORTS))
+    parser.add_argument("name", nargs="?", help="person for the person report")
+    parser.add_argument("--from", dest="start", default="0000-00-00", help="first day, YYYY-MM-DD")
+    parser.add_argument("--to", dest="end", default="9999-99-99", help="last day, YYYY-MM-DD")
+    parser.add_argument("--directory", default="attendance", help="folder with the attendance CSVs")
+    args = parser.parse_args()
+    if args.report == "person" and not args.name:
+        parser.error("the person report needs a name")
+
+    store = AttendanceStore(args.directory)
+    start = time.perf_counter()
+    added = store.ingest()
+    ingest_ms = 1000.0 * (time.perf_counter() - start)
+
+    headers, query = REPORTS[args.report]
+    start = time.perf_counter()
+    if args.report == "person":
+        rows = query(store, args.name, args.start, args.end)
+    else:
+        rows = query(store, args.start, args.end)
+    query_ms = 1000.0 * (time.perf_counter() - start)
+    store.close()
+
+    writer = csv.writer(sys.stdout)
+    writer.writerow(headers)
+    writer.writerows(rows)
+    print(f"{len(rows)} rows, ingested {added} new events in {ingest_ms:.1f} ms, query {query_ms:.1f} ms",
+          file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,448 @@
+"""Headless benchmarks for the recognition pipeline
+
+    python benchmark.py faces face.jpg --max-faces 8
+    python benchmark.py detect entrance.mp4 --scales 1 0.5 0.25 --upsample 0 1
+    python benchmark.py startup --image face.jpg
+    python benchmark.py render --frame-sizes 640x480 1920x1080 --tile 640x360
+    python benchmark.py suite --image face.jpg --galleries 1000 10000 100000 1000000 --output results.json
+    python benchmark.py suite --galleries 100000 --backends flat ivf --dtypes float64 float32
+
+`suite` is the reproducible run meant to be compared across commits: fixed
+seeds, no camera, and one JSON document with the environment, the match
+stage per gallery size, gallery dtype and index backend (latency, memory,
+recall and match drift against float64), and the per-stage cost of the
+whole pipeline per frame size and face count.
+"""
+import argparse
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+import tracemalloc
+import cv2
+import numpy as np
+from face_gallery import FaceGallery
+from frame_pipeline import FrameBuffers, render_rgb
+
+
+def random_gallery(size, seed=0, index=None, dtype=np.float64):
+    """Gallery of random unit-scale descriptors for timing the match stage"""
+    rng = np.random.default_rng(seed)
+    gallery = FaceGallery(capacity=max(size, 1), dtype=dtype)
+    if index is not None:
+        gallery.index = index
+        index.attach(gallery)
+    gallery.extend(np.arange(size), [f"person_{i}" for i in range(size)],
+                   rng.normal(0.0, 0.1, (size, gallery.dim)))
+    return gallery
+
+
+def tile_faces(image, count, tile=240):
+    """Frame containing count copies of a face photo laid out on a grid"""
+    cols = int(np.ceil(np.sqrt(count)))
+    rows = int(np.ceil(count / cols))
+    face = cv2.resize(image, (tile, tile))
+    frame = np.zeros((rows * tile, cols * tile, 3), dtype=np.uint8)
+    for i in range(count):
+        r, c = divmod(i, cols)
+        frame[r * tile:(r + 1) * tile, c * tile:(c + 1) * tile] = face
+    return frame
+
+
+def compose_frame(image, count, width, height):
+    """width x height frame with count copies of a face photo, or a blank frame without one"""
+    frame = np.zeros((height, width, 3), dtype=np.uint8)
+    if image is None or count == 0:
+        return frame
+    cols = int(np.ceil(np.sqrt(count)))
+    rows = int(np.ceil(count / cols))
+    tile = min(width // cols, height // rows)
+    tiled = tile_faces(image, count, tile)
+    frame[:tiled.shape[0], :tiled.shape[1]] = tiled
+    return frame
+
+
+def load_frames(paths, stride=5, limit=200):
+    """BGR frames from image files and/or every stride-th frame of video files"""
+    frames = []
+    for path in paths:
+        image = cv2.imread(path)
+        if image is not None:
+            frames.append(image)
+            continue
+        cap = cv2.VideoCapture(path)
+        index = 0
+        while len(frames) < limit:
+            ret, frame = cap.read()
+            if not ret:
+                break
+            if index % stride == 0:
+                frames.append(frame)
+            index += 1
+        cap.release()
+    return frames[:limit]
+
+
+def time_call(fn, repeats):
+    """Median wall time of fn in milliseconds"""
+    samples = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return 1000.0 * float(np.median(samples))
+
+
+def bench_faces(args):
+    """Per-frame cost of detect, batched embed and batched match against face count"""
+    from recognition import embed_faces, models
+    detector = models.detector
+
+    image = cv2.imread(args.image)
+    if image is None:
+        raise SystemExit(f"Cannot read image: {args.image}")
+    gallery = random_gallery(args.gallery)
+
+    print(f"{'faces':>5} {'found':>5} {'detect_ms':>10} {'embed_ms':>9} {'match_ms':>9} "
+          f"{'total_ms':>9} {'per_face_ms':>11}")
+    for count in range(1, args.max_faces + 1):
+        rgb = cv2.cvtColor(tile_faces(image, count), cv2.COLOR_BGR2RGB)
+        boxes = list(detector(rgb))
+        _, descriptors = embed_faces(rgb, boxes)
+
+        detect_ms = time_call(lambda: detector(rgb), args.repeats)
+        embed_ms = time_call(lambda: embed_faces(rgb, boxes), args.repeats)
+        match_ms = time_call(lambda: gallery.match_many(descriptors), args.repeats)
+        total = detect_ms + embed_ms + match_ms
+        print(f"{count:>5} {len(boxes):>5} {detect_ms:>10.2f} {embed_ms:>9.2f} {match_ms:>9.3f} "
+              f"{total:>9.2f} {total / max(len(boxes), 1):>11.2f}")
+
+
+def bench_detect(args):
+    """Detection latency and miss rate for each scale/upsample/ROI setting
+
+    Misses are counted against full-resolution detection with one upsample
+    pass; a reference face counts as found when a box overlaps it with
+    IoU >= 0.5.
+    """
+    from recognition import FaceDetector
+    from face_tracking import box_iou
+
+    frames = [cv2.cvtColor(f, cv2.COLOR_BGR2RGB) for f in load_frames(args.inputs, args.stride)]
+    if not frames:
+        raise SystemExit("No readable frames")
+    reference_detector = FaceDetector(scale=1.0, upsample=1)
+    reference = [reference_detector.detect(f) for f in frames]
+    total_faces = sum(len(r) for r in reference)
+    print(f"{len(frames)} frames ({frames[0].shape[1]}x{frames[0].shape[0]}), "
+          f"{total_faces} reference faces")
+
+    print(f"{'scale':>5} {'upsample':>8} {'roi':>5} {'detect_ms':>10} {'p95_ms':>8} {'miss_rate':>9}")
+    for roi_margin in args.roi:
+        margin = None if roi_margin < 0 else roi_margin
+        for upsample in args.upsample:
+            for scale in args.scales:
+                face_detector = FaceDetector(scale, upsample, margin)
+                times, missed = [], 0
+                for frame, expected in zip(frames, reference):
+                    start = time.perf_counter()
+                    boxes = face_detector.detect(frame)
+                    times.append(1000.0 * (time.perf_counter() - start))
+                    missed += sum(1 for ref in expected
+                                  if not any(box_iou(ref, b) >= 0.5 for b in boxes))
+                miss_rate = missed / total_faces if total_faces else 0.0
+                print(f"{scale:>5} {upsample:>8} {'off' if margin is None else margin:>5} "
+                      f"{np.median(times):>10.2f} {np.percentile(times, 95):>8.2f} {miss_rate:>9.3f}")
+
+
+STARTUP_SCRIPT = r"""
+import json, sys, time
+sys.path.insert(0, sys.argv[1])
+timings = {}
+start = time.perf_counter()
+import cv2, numpy
+timings["import_cv2_numpy"] = time.perf_counter() - start
+start = time.perf_counter()
+import PyQt5.QtWidgets
+timings["import_pyqt"] = time.perf_counter() - start
+start = time.perf_counter()
+from face_gallery import FaceGallery
+from recognition import analyze_frame, models
+timings["import_app"] = time.perf_counter() - start
+models.load()
+timings.update({"load_" + name: seconds for name, seconds in models.timings.items()})
+models.warm_up()
+timings["warm_up"] = models.timings["warm_up"]
+frame = cv2.imread(sys.argv[2]) if sys.argv[2] else None
+if frame is None:
+    frame = numpy.zeros((480, 640, 3), dtype=numpy.uint8)
+start = time.perf_counter()
+analyze_frame(frame, FaceGallery())
+timings["first_frame"] = time.perf_counter() - start
+print(json.dumps(timings))
+"""
+
+
+def bench_startup(args):
+    """Import, model load, warm-up and first-frame latency, each in a fresh process"""
+    runs = []
+    for _ in range(args.repeats):
+        output = subprocess.run([sys.executable, "-c", STARTUP_SCRIPT, os.path.dirname(os.path.abspath(__file__)),
+                                 args.image or ""], capture_output=True, text=True, check=True).stdout
+        runs.append(json.loads(output.strip().splitlines()[-1]))
+
+    print(f"{'stage':<24} {'median_ms':>10}")
+    for stage in runs[0]:
+        print(f"{stage:<24} {1000.0 * np.median([r[stage] for r in runs]):>10.1f}")
+    total = [sum(r.values()) for r in runs]
+    print(f"{'total':<24} {1000.0 * np.median(total):>10.1f}")
+
+
+def render_copying(image, boxes):
+    """The previous render path: copy, draw in BGR, convert to a new RGB array, copy into the QImage"""
+    from PyQt5.QtGui import QImage
+    image = image.copy()
+    for box in boxes:
+        cv2.putText(image, "person", (box.left(), box.top()-10), cv2.FONT_HERSHEY_SIMPLEX, 0.9, (0,255,0), 2)
+        cv2.rectangle(image, (box.left(), box.top()), (box.right(), box.bottom()), (0,255,0), 2)
+    image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+    h, w, ch = image.shape
+    return QImage(image.data, w, h, ch * w, QImage.Format_RGB888).copy()
+
+
+def render_buffered(image, faces, buffers, size):
+    """The render path of the camera streams: one conversion into reused buffers, wrapped as is"""
+    from PyQt5.QtGui import QImage
+    rgb = render_rgb(image, faces, buffers, size)
+    h, w, ch = rgb.shape
+    return QImage(rgb.data, w, h, ch * w, QImage.Format_RGB888)
+
+
+def bench_render(args):
+    """Per-frame time and allocated bytes of the render stage, previous path against buffered"""
+    import dlib
+    from recognition import FaceMatch
+    tile = tuple(int(v) for v in args.tile.split("x")) if args.tile else None
+    print(f"{'frame':>10} {'path':>9} {'ms':>7} {'alloc_kb':>9} {'buffer_allocs':>13}")
+    for frame_size in args.frame_sizes:
+        width, height = (int(v) for v in frame_size.split("x"))
+        image = np.random.default_rng(args.seed).integers(0, 256, (height, width, 3), dtype=np.uint8)
+        boxes = [dlib.rectangle(width // 4, height // 4, width // 2, height // 2)] * args.faces
+        faces = [FaceMatch(box, None, None, "person", 0.0, None) for box in boxes]
+        buffers = FrameBuffers()
+        paths = [("copying", lambda: render_copying(image, boxes)),
+                 ("buffered", lambda: render_buffered(image, faces, buffers, tile))]
+        for name, render in paths:
+            render()  # warm-up, allocates the buffers once
+            allocations = buffers.allocations
+            tracemalloc.start()
+            peaks = []
+            for _ in range(args.repeats):
+                tracemalloc.reset_peak()
+                current = tracemalloc.get_traced_memory()[0]
+                render()
+                peaks.append(tracemalloc.get_traced_memory()[1] - current)
+            tracemalloc.stop()
+            ms = time_call(render, args.repeats)
+            reallocated = buffers.allocations - allocations if name == "buffered" else "-"
+            print(f"{frame_size:>10} {name:>9} {ms:>7.2f} {np.median(peaks) / 1024:>9.1f} {reallocated:>13}")
+
+
+def environment():
+    """Commit, library versions and CPU description stored with every suite result"""
+    try:
+        commit = subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        commit = None
+    try:
+        import dlib
+        dlib_version = dlib.__version__
+    except ImportError:
+        dlib_version = None
+    return {
+        "commit": commit,
+        "time": time.strftime("%Y-%m-%d %H:%M:%S"),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "opencv": cv2.__version__,
+        "dlib": dlib_version,
+        "machine": platform.machine(),
+        "processor": platform.processor(),
+        "system": platform.platform(),
+        "cpu_count": os.cpu_count(),
+        "opencv_threads": cv2.getNumThreads(),
+    }
+
+
+def bench_match_sizes(args):
+    """Build time, query latency, memory, recall and match drift for each gallery size
+
+    Drift is measured against a float64 exact gallery: the queries are half
+    noisy copies of enrolled rows and half unknown faces, and match_agreement
+    is the fraction whose (name or no match) decision is unchanged.
+    """
+    from face_index import create_index, recall_report
+
+    results = []
+    for size in args.galleries:
+        baseline = random_gallery(size, args.seed)
+        rng = np.random.default_rng(args.seed + 1)
+        n = min(args.queries, size)
+        known = baseline.descriptors[rng.choice(size, size=n, replace=False)] + rng.normal(0.0, 0.04, (n, baseline.dim))
+        unknown = rng.normal(0.0, 0.1, (n, baseline.dim))
+        queries = np.vstack([known, unknown])
+        expected = [name for name, _ in baseline.match_many(queries, args.threshold)]
+        del baseline
+
+        for dtype in args.dtypes:
+            for backend in args.backends:
+                start = time.perf_counter()
+                gallery = random_gallery(size, args.seed, create_index(backend), np.dtype(dtype))
+                build_ms = 1000.0 * (time.perf_counter() - start)
+
+                report = recall_report(gallery, gallery.index, args.queries, seed=args.seed)
+                batch = queries[:args.batch]
+                batch_ms = time_call(lambda: gallery.match_many(batch, args.threshold), args.repeats)
+                names = [name for name, _ in gallery.match_many(queries, args.threshold)]
+                agreement = float(np.mean([a == b for a, b in zip(names, expected)]))
+                memory = gallery.descriptors.nbytes + gallery.index.nbytes
+                results.append({
+                    "gallery_size": size,
+                    "dtype": dtype,
+                    "backend": backend,
+                    "build_ms": build_ms,
+                    "query_ms": report["index_ms"],
+                    "exact_query_ms": report["exact_ms"],
+                    "batch_size": len(batch),
+                    "batch_query_ms": batch_ms / len(batch),
+                    "recall_at_1": report["recall_at_1"],
+                    "match_agreement": agreement,
+                    "index_bytes": gallery.index.nbytes,
+                    "memory_bytes": memory,
+                    "bytes_per_face": memory / size,
+                })
+                print(f"  match  n={size:<8} {dtype:<7} {backend:<10} query {report['index_ms']:.3f} ms  "
+                      f"batched {batch_ms / len(batch):.3f} ms  recall {report['recall_at_1']:.3f}  "
+                      f"agreement {agreement:.3f}  {memory / size:.0f} B/face", file=sys.stderr)
+                del gallery
+    return results
+
+
+def bench_pipeline_grid(args):
+    """Per-stage p50 and end-to-end throughput of analyze_frame per frame size and face count"""
+    from perf_stats import stages
+    from recognition import FaceDetector, analyze_frame, models
+
+    try:
+        models.load()
+    except RuntimeError as e:
+        return {"skipped": f"face models unavailable: {e}"}
+    image = cv2.imread(args.image) if args.image else None
+    if args.image and image is None:
+        raise SystemExit(f"Cannot read image: {args.image}")
+    gallery = random_gallery(args.pipeline_gallery, args.seed)
+
+    results = []
+    for size in args.frame_sizes:
+        width, height = (int(v) for v in size.lower().split("x"))
+        for count in args.faces:
+            frame = compose_frame(image, count, width, height)
+            face_detector = FaceDetector(args.scale, args.upsample)
+            found = len(analyze_frame(frame, gallery, face_detector=face_detector))
+            stages.reset()
+            end_to_end = time_call(lambda: analyze_frame(frame, gallery, face_detector=face_detector),
+                                   args.repeats)
+            stage_ms = {name: s["p50_ms"] for name, s in stages.snapshot()["stages"].items()}
+            results.append({
+                "frame_size": f"{width}x{height}",
+                "faces": count if image is not None else 0,
+                "found": found,
+                "stages_p50_ms": stage_ms,
+                "end_to_end_ms": end_to_end,
+                "frames_per_second": 1000.0 / end_to_end if end_to_end else 0.0,
+            })
+            print(f"  frame  {width}x{height} faces={count} found={found} {end_to_end:.2f} ms", file=sys.stderr)
+    return results
+
+
+def bench_suite(args):
+    """Match and pipeline benchmarks with fixed seeds, written as one JSON document"""
+    if args.threads is not None:
+        cv2.setNumThreads(args.threads)
+    result = {
+        "environment": environment(),
+        "settings": {k: v for k, v in vars(args).items() if k not in ("func", "command")},
+        "match": bench_match_sizes(args),
+        "pipeline": bench_pipeline_grid(args),
+    }
+    document = json.dumps(result, indent=2)
+    if args.output:
+        with open(args.output, "w") as file:
+            file.write(document + "\n")
+        print(f"Results written to {args.output}", file=sys.stderr)
+    else:
+        print(document)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    faces = sub.add_parser("faces", help="per-frame cost as a function of face count")
+    faces.add_argument("image", help="photo containing one face")
+    faces.add_argument("--max-faces", type=int, default=8)
+    faces.add_argument("--gallery", type=int, default=1000, help="random gallery size")
+    faces.add_argument("--repeats", type=int, default=5)
+    faces.set_defaults(func=bench_faces)
+
+    detect = sub.add_parser("detect", help="detection latency and miss rate per setting")
+    detect.add_argument("inputs", nargs="+", help="images and/or video files")
+    detect.add_argument("--scales", type=float, nargs="+", default=[1.0, 0.75, 0.5, 0.25])
+    detect.add_argument("--upsample", type=int, nargs="+", default=[0, 1])
+    detect.add_argument("--roi", type=float, nargs="+", default=[-1.0, 0.5],
+                        help="ROI margins to test, negative disables the ROI")
+    detect.add_argument("--stride", type=int, default=5, help="video frame stride")
+    detect.set_defaults(func=bench_detect)
+
+    startup = sub.add_parser("startup", help="import, model load and first-frame latency")
+    startup.add_argument("--image", default=None, help="frame for the first-frame timing (default: blank)")
+    startup.add_argument("--repeats", type=int, default=3)
+    startup.set_defaults(func=bench_startup)
+
+    render = sub.add_parser("render", help="render stage time and allocations, copying against buffered")
+    render.add_argument("--frame-sizes", nargs="+", default=["640x480", "1280x720", "1920x1080"])
+    render.add_argument("--tile", default="640x480", help="video tile size frames are scaled to, empty for none")
+    render.add_argument("--faces", type=int, default=2)
+    render.add_argument("--repeats", type=int, default=50)
+    render.add_argument("--seed", type=int, default=0)
+    render.set_defaults(func=bench_render)
+
+    suite = sub.add_parser("suite", help="reproducible match and pipeline benchmarks as JSON")
+    suite.add_argument("--image", default=None, help="photo containing one face (default: blank frames)")
+    suite.add_argument("--galleries", type=int, nargs="+", default=[1000, 10000, 100000],
+                       help="synthetic gallery sizes for the match stage")
+    suite.add_argument("--backends", nargs="+", default=["flat", "ivf"], help="index backends to compare")
+    suite.add_argument("--dtypes", nargs="+", default=["float64", "float32"], help="gallery matrix dtypes")
+    suite.add_argument("--threshold", type=float, default=0.6, help="match distance threshold")
+    suite.add_argument("--queries", type=int, default=100, help="single queries per gallery for latency/recall")
+    suite.add_argument("--batch", type=int, default=8, help="descriptors per batched match")
+    suite.add_argument("--frame-sizes", nargs="+", default=["320x240", "640x480", "1280x720"])
+    suite.add_argument("--faces", type=int, nargs="+", default=[1, 2, 4])
+    suite.add_argument("--pipeline-gallery", type=int, default=1000, help="gallery size for pipeline runs")
+    suite.add_argument("--scale", type=float, default=1.0, help="detection downscale factor")
+    suite.add_argument("--upsample", type=int, default=0, help="HOG upsampling passes")
+    suite.add_argument("--repeats", type=int, default=5)
+    suite.add_argument("--seed", type=int, default=0)
+    suite.add_argument("--threads", type=int, default=None, help="OpenCV threads (default: library default)")
+    suite.add_argument("--output", default=None, help="JSON file (default: stdout)")
+    suite.set_defaults(func=bench_suite)
+
+    args = parser.parse_args()
+    args.func(args)
+
+
+if __name__ == "__main__":
+    main()
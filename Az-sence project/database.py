@@ -0,0 +1,195 @@
+import logging
+import os
+import sqlite3
+from urllib.request import pathname2url
+import numpy as np
+
+DB_PATH = "users_dlib.db"
+SCHEMA_VERSION = 4
+DESCRIPTOR_VERSION = 1     # dlib_face_recognition_resnet_model_v1, stored as float32
+
+log = logging.getLogger(__name__)
+
+
+def create_connection(path=DB_PATH):
+    """Create database connection, migrating the schema when needed"""
+    conn = sqlite3.connect(path)
+    conn.execute("PRAGMA foreign_keys = ON")
+    # WAL lets readers (recognition, face list) run while enrollment writes
+    conn.execute("PRAGMA journal_mode = WAL")
+    conn.execute("PRAGMA synchronous = NORMAL")
+    migrate(conn)
+    return conn
+
+
+def read_only_connection(path=DB_PATH):
+    """Connection that cannot write, for reader threads; the schema must already exist"""
+    uri = "file:" + pathname2url(os.path.abspath(path)) + "?mode=ro"
+    # Closed by whoever opened it, possibly from another thread at shutdown
+    return sqlite3.connect(uri, uri=True, check_same_thread=False)
+
+
+def schema_version(conn):
+    return conn.execute("PRAGMA user_version").fetchone()[0]
+
+
+def migrate(conn):
+    """Bring the database up to SCHEMA_VERSION in one transaction
+
+    Python's sqlite3 commits before DDL statements in its default mode, so
+    the migration runs in autocommit mode inside an explicit BEGIN IMMEDIATE:
+    the table renames and creations are rolled back with the row copies if
+    anything fails. A users_v1 table left behind by an interrupted migration
+    of an older release is migrated whatever the recorded version.
+    """
+    if schema_version(conn) >= SCHEMA_VERSION and not table_columns(conn, "users_v1"):
+        return
+    isolation_level, conn.isolation_level = conn.isolation_level, None
+    try:
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            # Read again under the write lock, another process may have migrated meanwhile
+            _migrate(conn, schema_version(conn))
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+    finally:
+        conn.isolation_level = isolation_level
+
+
+def _migrate(conn, version):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS accounts (
+            username TEXT PRIMARY KEY,
+            password TEXT,
+            role TEXT
+        )
+    """)
+    if version < 2:
+        migrate_v2(conn)
+    if version < 3:
+        migrate_v3(conn)
+    if version < 4:
+        migrate_v4(conn)
+    if table_columns(conn, "users_v1"):
+        copy_legacy_users(conn)
+    conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+
+def migrate_v2(conn):
+    """Integer keys, name index, float32 descriptors and a separate image table
+
+    Version 1 stored name, float64 descriptor, JPEG image and created_at in a
+    single users table without a key. It is renamed to users_v1 here and its
+    rows are copied by copy_legacy_users once the rest of the schema exists.
+    """
+    legacy = table_columns(conn, "users")
+    if legacy and "id" not in legacy:
+        conn.execute("ALTER TABLE users RENAME TO users_v1")
+
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS users (
+            id INTEGER PRIMARY KEY,
+            name TEXT NOT NULL,
+            descriptor BLOB NOT NULL,
+            descriptor_dim INTEGER NOT NULL,
+            descriptor_version INTEGER NOT NULL,
+            created_at TEXT
+        )
+    """)
+    conn.execute("CREATE INDEX IF NOT EXISTS idx_users_name ON users (name)")
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS face_images (
+            user_id INTEGER PRIMARY KEY REFERENCES users (id) ON DELETE CASCADE,
+            image BLOB NOT NULL
+        )
+    """)
+
+
+def copy_legacy_users(conn):
+    """Move the version 1 rows of users_v1 into users, keeping their rowid as id
+
+    Rows whose float64 descriptor is missing or not a whole number of floats
+    cannot be matched and are skipped with a warning instead of aborting the
+    migration. Ids already present (a migration resumed after a crash) are
+    left alone.
+    """
+    rows = conn.execute("SELECT rowid, name, descriptor, image, created_at FROM users_v1").fetchall()
+    users, images, skipped = [], [], []
+    for row_id, name, blob, image, created_at in rows:
+        if not isinstance(blob, bytes) or not blob or len(blob) % 8:
+            skipped.append(name)
+            continue
+        descriptor = np.frombuffer(blob, dtype=np.float64)
+        users.append((row_id, name, encode_descriptor(descriptor), len(descriptor),
+                      DESCRIPTOR_VERSION, created_at))
+        if image is not None:
+            images.append((row_id, image))
+    conn.executemany("INSERT OR IGNORE INTO users (id, name, descriptor, descriptor_dim, descriptor_version, "
+                     "created_at) VALUES (?, ?, ?, ?, ?, ?)", users)
+    conn.executemany("INSERT OR IGNORE INTO face_images (user_id, image) VALUES (?, ?)", images)
+    conn.execute("DROP TABLE users_v1")
+    if skipped:
+        log.warning("Skipped %d legacy users without a valid descriptor: %s", len(skipped), ", ".join(map(str, skipped)))
+
+
+def migrate_v3(conn):
+    """Generation counter bumped by every change to the users table
+
+    Caches derived from users (the memory-mapped descriptor store) record the
+    generation they reflect and compare it with this counter to detect
+    writes made by any other connection or process.
+    """
+    conn.execute("CREATE TABLE IF NOT EXISTS users_generation (value INTEGER NOT NULL)")
+    if conn.execute("SELECT COUNT(*) FROM users_generation").fetchone()[0] == 0:
+        conn.execute("INSERT INTO users_generation (value) VALUES (0)")
+    for event in ("INSERT", "UPDATE", "DELETE"):
+        conn.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS users_generation_{event.lower()} AFTER {event} ON users
+            BEGIN
+                UPDATE users_generation SET value = value + 1;
+            END
+        """)
+
+
+def migrate_v4(conn):
+    """Attendance table, previously created on first use by the attendance writer"""
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS attendance (
+            name TEXT,
+            timestamp TEXT,
+            date TEXT
+        )
+    """)
+
+
+def users_generation(conn):
+    return conn.execute("SELECT value FROM users_generation").fetchone()[0]
+
+
+def table_columns(conn, table):
+    return [row[1] for row in conn.execute(f"PRAGMA table_info({table})")]
+
+
+def encode_descriptor(descriptor):
+    """Compact float32 bytes for the users.descriptor column"""
+    return np.asarray(descriptor, dtype=np.float32).tobytes()
+
+
+def decode_descriptors(blobs, dim):
+    """Stack descriptor blobs into an (n, dim) float64 matrix"""
+    if not blobs:
+        return np.empty((0, dim))
+    return np.frombuffer(b"".join(blobs), dtype=np.float32).reshape(-1, dim).astype(np.float64)
+
+
+def insert_user(cursor, name, descriptor, image, created_at):
+    """Insert a user and its face image, returns the new user id"""
+    cursor.execute("INSERT INTO users (name, descriptor, descriptor_dim, descriptor_version, created_at) "
+                   "VALUES (?, ?, ?, ?, ?)",
+                   (name, encode_descriptor(descriptor), len(descriptor), DESCRIPTOR_VERSION, created_at))
+    user_id = cursor.lastrowid
+    if image is not None:
+        cursor.execute("INSERT INTO face_images (user_id, image) VALUES (?, ?)", (user_id, image))
+    return user_id
@@ -0,0 +1,200 @@
+import glob
+import json
+import os
+import numpy as np
+from database import DESCRIPTOR_VERSION, decode_descriptors, users_generation
+from face_gallery import DESCRIPTOR_DIM, FaceGallery
+
+STORE_FORMAT = 1
+STORE_DTYPE = np.float32
+ARRAYS = ("descriptors", "norms", "ids", "names")
+
+
+def store_path_for(db_path):
+    """Store directory kept next to the users database"""
+    return os.path.splitext(db_path)[0] + ".store"
+
+
+class DescriptorStore:
+    """Memory-mapped export of the users descriptors for fast gallery loading
+
+    The store directory holds one version of the descriptor matrix, squared
+    norms, ids and names as .npy files, a manifest naming the current version
+    and the users generation it reflects, and an append log of changes made
+    since. Loading maps the arrays copy-on-write, so every process shares the
+    same pages through the OS cache.
+
+    Replaying a logged change into the gallery would copy the mapped matrix
+    into private memory (an add grows it, a removal writes to its pages), so
+    refresh() folds a non-empty log into a new version first and only
+    replays it when the store cannot be written. The gallery still goes
+    private on the first change made while it is running.
+
+    SQLite stays the source of truth: when the manifest and log do not add
+    up to the database's users generation (e.g. another process enrolled
+    users without logging them) the store is exported again from the users
+    table. compact() does the same once the log grows past compact_after.
+    """
+
+    def __init__(self, db_path, compact_after=1000):
+        self.path = store_path_for(db_path)
+        self.compact_after = compact_after
+        self.log_entries = 0
+
+    @property
+    def manifest_path(self):
+        return os.path.join(self.path, "manifest.json")
+
+    @property
+    def log_path(self):
+        return os.path.join(self.path, "log.jsonl")
+
+    def array_path(self, version, name):
+        return os.path.join(self.path, f"v{version}.{name}.npy")
+
+    def refresh(self, conn):
+        """Export when stale or logged, returns the current manifest and the log entries to replay"""
+        generation = users_generation(conn)
+        manifest = self._read_manifest()
+        entries = None
+        if manifest is not None and manifest["generation"] <= generation:
+            entries = self._replayable(manifest, generation)
+        if entries is None:
+            return self.export(conn), []
+        if entries:
+            try:
+                return self.export(conn), []
+            except OSError:
+                pass  # read-only store, replay into a private copy instead
+        return manifest, entries
+
+    def load_gallery(self, conn, dtype=STORE_DTYPE):
+        """Gallery backed by the store, exported from conn first when stale
+
+        Any dtype other than STORE_DTYPE gives the gallery a private copy of
+        the matrix instead of the shared mapping.
+        """
+        manifest, entries = self.refresh(conn)
+        version = manifest["version"]
+        try:
+            arrays = {name: np.load(self.array_path(version, name), mmap_mode="c") for name in ARRAYS}
+        except (OSError, ValueError):
+            return FaceGallery.from_connection(conn, dtype)
+        if any(len(a) != manifest["count"] for a in arrays.values()):
+            # Files replaced by a concurrent export, read the database directly this time
+            return FaceGallery.from_connection(conn, dtype)
+        descriptors = arrays["descriptors"]
+        if descriptors.dtype != dtype:
+            descriptors = descriptors.astype(dtype)
+        # tolist() is the one copy of the names, from_arrays adopts the list as is
+        gallery = FaceGallery.from_arrays(arrays["ids"], arrays["names"].tolist(), descriptors, arrays["norms"])
+
+        for entry in entries:
+            self._apply(gallery, entry)
+        self.log_entries = len(entries)
+        return gallery
+
+    def export(self, conn):
+        """Write a new version of the store from the users table, returns its manifest"""
+        generation = users_generation(conn)
+        rows = conn.execute("SELECT id, name, descriptor FROM users WHERE descriptor_dim = ? ORDER BY id",
+                            (DESCRIPTOR_DIM,)).fetchall()
+        descriptors = decode_descriptors([row[2] for row in rows], DESCRIPTOR_DIM).astype(STORE_DTYPE)
+        names = [row[1] for row in rows]
+        arrays = {
+            "descriptors": descriptors,
+            "norms": np.einsum("ij,ij->i", descriptors, descriptors, dtype=np.float64),
+            "ids": np.array([row[0] for row in rows], dtype=np.int64),
+            "names": np.array(names, dtype=f"<U{max([len(n) for n in names] + [1])}"),
+        }
+
+        if not os.path.exists(self.path):
+            os.makedirs(self.path)
+        previous = self._read_manifest()
+        version = previous["version"] + 1 if previous else 1
+        for name, array in arrays.items():
+            tmp_path = self.array_path(version, name) + f".{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                np.save(f, array)
+            os.replace(tmp_path, self.array_path(version, name))
+
+        manifest = {"format": STORE_FORMAT, "version": version, "generation": generation,
+                    "descriptor_version": DESCRIPTOR_VERSION, "dim": DESCRIPTOR_DIM, "count": len(rows)}
+        tmp_path = self.manifest_path + f".{os.getpid()}.tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(manifest, f)
+        os.replace(tmp_path, self.manifest_path)
+        open(self.log_path, "w").close()
+        self.log_entries = 0
+        self._remove_old_versions(version)
+        return manifest
+
+    def append(self, conn, before, after, op, *args):
+        """Log a committed change that took the users generation from before to after"""
+        entry = {"from": before, "to": after, "op": op,
+                 "args": [a.tolist() if isinstance(a, np.ndarray) else a for a in args]}
+        if not os.path.exists(self.path):
+            return  # nothing exported yet, the next load exports everything
+        with open(self.log_path, "a") as f:
+            f.write(json.dumps(entry) + "\n")
+        self.log_entries += 1
+        if self.log_entries >= self.compact_after:
+            self.compact(conn)
+
+    def compact(self, conn):
+        """Fold the log into a new exported version"""
+        if self.log_entries:
+            self.export(conn)
+
+    def _read_manifest(self):
+        try:
+            with open(self.manifest_path) as f:
+                manifest = json.load(f)
+        except (OSError, ValueError):
+            return None
+        if (manifest.get("format") != STORE_FORMAT or manifest.get("dim") != DESCRIPTOR_DIM
+                or manifest.get("descriptor_version") != DESCRIPTOR_VERSION):
+            return None
+        return manifest
+
+    def _replayable(self, manifest, generation):
+        """Log entries leading from the manifest to generation, or None when they do not"""
+        current, entries = manifest["generation"], []
+        try:
+            with open(self.log_path) as f:
+                for line in f:
+                    try:
+                        entry = json.loads(line)
+                    except ValueError:
+                        break  # torn write at the end of the log
+                    if entry["to"] <= manifest["generation"]:
+                        continue  # already part of the exported version
+                    if entry["from"] != current:
+                        return None
+                    entries.append(entry)
+                    current = entry["to"]
+        except OSError:
+            pass
+        return entries if current == generation else None
+
+    def _apply(self, gallery, entry):
+        op, args = entry["op"], entry["args"]
+        if op == "add":
+            user_id, name, descriptor = args
+            gallery.add(user_id, name, np.asarray(descriptor))
+        elif op == "remove_name":
+            gallery.remove_name(*args)
+        elif op == "remove_id":
+            gallery.remove_id(*args)
+        elif op == "rename":
+            gallery.rename(*args)
+        else:
+            raise ValueError(f"Unknown store log operation: {op}")
+
+    def _remove_old_versions(self, version):
+        for path in glob.glob(os.path.join(self.path, "v*.npy")):
+            if not os.path.basename(path).startswith(f"v{version}."):
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass  # still mapped by another process on Windows, removed by a later export
@@ -0,0 +1,158 @@
+"""Headless batch enrollment of face photos into the users table
+
+    python enroll.py photos/                 # photos/<name>.jpg or photos/<name>/*.jpg
+    python enroll.py manifest.csv            # CSV with name,path columns
+    python enroll.py photos/ --workers 8 --batch-size 200
+
+Images already recorded in the enrollment_log table are skipped, so an
+interrupted run can simply be started again.
+"""
+import argparse
+import csv
+import datetime
+import multiprocessing
+import os
+import sys
+import time
+from database import DB_PATH, create_connection, insert_user
+from descriptor_store import DescriptorStore
+
+IMAGE_EXTENSIONS = {".jpg", ".jpeg", ".png", ".bmp", ".webp"}
+
+
+def collect_jobs(source):
+    """List (name, path) pairs from a photo directory or a CSV manifest"""
+    if os.path.isfile(source):
+        base = os.path.dirname(os.path.abspath(source))
+        with open(source, newline="", encoding="utf-8") as f:
+            return [(row["name"], os.path.join(base, row["path"])) for row in csv.DictReader(f)]
+
+    jobs = []
+    for root, _, files in os.walk(source):
+        for filename in sorted(files):
+            stem, ext = os.path.splitext(filename)
+            if ext.lower() not in IMAGE_EXTENSIONS:
+                continue
+            # photos/<name>/<any>.jpg uses the folder name, photos/<name>.jpg the file name
+            name = os.path.basename(root) if os.path.abspath(root) != os.path.abspath(source) else stem
+            jobs.append((name, os.path.join(root, filename)))
+    return jobs
+
+
+def init_worker(upsample):
+    """Load one set of dlib models per worker process"""
+    global _recognition, _upsample
+    import recognition
+    recognition.models.load()
+    _recognition = recognition
+    _upsample = upsample
+
+
+def process_image(job):
+    """Detect, landmark and embed the largest face of one photo"""
+    import cv2
+    name, path = job
+    try:
+        image = cv2.imread(path)
+        if image is None:
+            return name, path, None, None, "unreadable image"
+        rgb = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        faces = _recognition.models.detector(rgb, _upsample)
+        if len(faces) == 0:
+            return name, path, None, None, "no face found"
+        face = max(faces, key=lambda f: f.area())
+        _, descriptors = _recognition.embed_faces(rgb, [face])
+        _, img_bytes = cv2.imencode(".jpg", _recognition.crop_face(image, face))
+        return name, path, descriptors[0], img_bytes.tobytes(), None
+    except Exception as e:
+        return name, path, None, None, str(e)
+
+
+def ensure_log_table(conn):
+    conn.execute("""
+        CREATE TABLE IF NOT EXISTS enrollment_log (
+            path TEXT PRIMARY KEY,
+            status TEXT,
+            message TEXT,
+            processed_at TEXT
+        )
+    """)
+    conn.commit()
+
+
+def write_batch(conn, results):
+    """Insert a batch of users and their log entries in one transaction"""
+    now = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+    log = [(path, "failed" if error else "enrolled", error, now) for _, path, _, _, error in results]
+    with conn:
+        cursor = conn.cursor()
+        for name, _, descriptor, image, error in results:
+            if error is None:
+                insert_user(cursor, name, descriptor, image, now)
+        conn.executemany("INSERT OR REPLACE INTO enrollment_log (path, status, message, processed_at) "
+                         "VALUES (?, ?, ?, ?)", log)
+
+
+def enroll(source, db_path=DB_PATH, workers=None, batch_size=100, upsample=1, retry_failed=False):
+    """Enroll every photo under source, returns a summary dict"""
+    conn = create_connection(db_path)
+    ensure_log_table(conn)
+    done_status = ("enrolled",) if retry_failed else ("enrolled", "failed")
+    done = {row[0] for row in conn.execute(
+        f"SELECT path FROM enrollment_log WHERE status IN ({','.join('?' * len(done_status))})", done_status)}
+
+    jobs = collect_jobs(source)
+    pending = [job for job in jobs if job[1] not in done]
+    summary = {"total": len(jobs), "skipped": len(jobs) - len(pending), "enrolled": 0, "failed": 0}
+    print(f"{len(jobs)} images found, {summary['skipped']} already processed, {len(pending)} to enroll")
+    if not pending:
+        conn.close()
+        return summary
+
+    workers = workers or os.cpu_count() or 1
+    start = time.perf_counter()
+    batch = []
+    with multiprocessing.Pool(workers, initializer=init_worker, initargs=(upsample,)) as pool:
+        for i, result in enumerate(pool.imap_unordered(process_image, pending, chunksize=4), 1):
+            batch.append(result)
+            if result[4] is None:
+                summary["enrolled"] += 1
+            else:
+                summary["failed"] += 1
+                print(f"  failed: {result[1]}: {result[4]}", file=sys.stderr)
+            if len(batch) >= batch_size or i == len(pending):
+                write_batch(conn, batch)
+                batch = []
+                elapsed = time.perf_counter() - start
+                rate = i / elapsed
+                eta = (len(pending) - i) / rate if rate else 0.0
+                print(f"  {i}/{len(pending)} images, {rate:.1f} img/s, ETA {eta:.0f}s")
+
+    elapsed = time.perf_counter() - start
+    # Export the new rows now so the next app start maps them instead of exporting
+    DescriptorStore(db_path).export(conn)
+    conn.close()
+    summary["seconds"] = elapsed
+    summary["images_per_second"] = len(pending) / elapsed if elapsed else 0.0
+    return summary
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Batch-enroll face photos without the GUI")
+    parser.add_argument("source", help="photo directory or CSV manifest with name,path columns")
+    parser.add_argument("--db", default=DB_PATH, help="users database")
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: CPU count)")
+    parser.add_argument("--batch-size", type=int, default=100, help="rows per database transaction")
+    parser.add_argument("--upsample", type=int, default=1, help="HOG upsampling passes for small faces")
+    parser.add_argument("--retry-failed", action="store_true", help="retry images that failed before")
+    args = parser.parse_args()
+
+    summary = enroll(args.source, args.db, args.workers, args.batch_size, args.upsample, args.retry_failed)
+    print(f"Enrolled {summary['enrolled']}, failed {summary['failed']}, skipped {summary['skipped']} "
+          f"of {summary['total']} images")
+    if "seconds" in summary:
+        print(f"{summary['seconds']:.1f}s, {summary['images_per_second']:.1f} images/s")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,411 @@
+import threading
+import numpy as np
+from database import decode_descriptors
+from face_index import FlatIndex
+
+DESCRIPTOR_DIM = 128
+AGGREGATIONS = ("min", "mean", "vote")
+
+# Person matching settings, shared by the GUI, model_server.py and recognize_video.py
+MATCH_AGGREGATION = "min"  # "min", "mean" or "vote" over each person's exemplars, None = closest row
+MATCH_TOP_K = 3            # Exemplars that vote with "vote"
+MATCH_CANDIDATES = 8       # Nearest rows from the index whose people are scored
+
+
+class PersonGroups:
+    """Gallery rows grouped by name, kept up to date as rows come and go
+
+    Every gallery row carries a person label. A person's members are its run
+    in a label-sorted order of the rows plus the rows appended since that
+    order was computed, so add() and renaming to a new name cost O(1). Only
+    removals and merging two people invalidate the order, which is sorted
+    again (integer argsort, no Python loop) on the next lookup.
+    """
+
+    def __init__(self):
+        self.names = []   # label -> name
+        self.labels = {}  # name -> label
+        self._order = np.empty(0, dtype=np.int64)
+        self._bounds = np.zeros(1, dtype=np.int64)
+        self._added = {}  # label -> positions appended since the last sort
+        self._stale = True
+
+    def label(self, name):
+        """Label of name, creating one for a new person"""
+        label = self.labels.get(name)
+        if label is None:
+            label = self.labels[name] = len(self.names)
+            self.names.append(name)
+        return label
+
+    def added(self, label, position):
+        if not self._stale:
+            self._added.setdefault(label, []).append(position)
+
+    def invalidate(self):
+        self._stale = True
+        self._added = {}
+
+    def rename(self, old_name, new_name, row_labels):
+        """Move old_name's rows to new_name, relabelling row_labels when new_name exists"""
+        old = self.labels.pop(old_name, None)
+        if old is None:
+            return
+        new = self.labels.get(new_name)
+        if new is None:
+            self.labels[new_name] = old
+            self.names[old] = new_name
+        else:
+            row_labels[row_labels == old] = new
+            self.invalidate()
+
+    def members(self, label, row_labels):
+        """Gallery positions of one person"""
+        if self._stale:
+            self._order = np.argsort(row_labels, kind="stable")
+            self._bounds = np.searchsorted(row_labels[self._order], np.arange(len(self.names) + 1))
+            self._added = {}
+            self._stale = False
+        if label + 1 < len(self._bounds):
+            base = self._order[self._bounds[label]:self._bounds[label + 1]]
+        else:
+            base = self._order[:0]
+        added = self._added.get(label)
+        return base if not added else np.concatenate([base, added])
+
+
+
+class FaceGallery:
+    """In-memory matrix of enrolled face descriptors with parallel id/name arrays
+
+    Safe to query from inference threads while the GUI thread enrolls,
+    renames or deletes users. dtype=np.float32 halves the memory of the
+    matrix at the cost of float32 distance arithmetic.
+    """
+
+    def __init__(self, dim=DESCRIPTOR_DIM, capacity=64, dtype=np.float64):
+        self.dim = dim
+        self._size = 0
+        self._descriptors = np.empty((capacity, dim), dtype=dtype)
+        self._sq_norms = np.empty(capacity, dtype=np.float64)
+        self._ids = np.empty(capacity, dtype=np.int64)
+        self._labels = np.empty(capacity, dtype=np.int64)
+        self._names = []
+        self._lock = threading.RLock()
+        self.version = 0
+        self.index = FlatIndex()
+        self.index.attach(self)
+        self.aggregation = None
+        self.top_k = 3
+        self.candidates = 8
+        self._people = None
+
+    @classmethod
+    def from_connection(cls, conn, dtype=np.float64):
+        """Build a gallery from every row of the users table"""
+        gallery = cls(dtype=dtype)
+        gallery.load(conn)
+        return gallery
+
+    @classmethod
+    def from_arrays(cls, ids, names, descriptors, sq_norms):
+        """Gallery that adopts existing arrays and the names list without copying them, e.g. memory maps"""
+        gallery = cls(dim=descriptors.shape[1], capacity=0, dtype=descriptors.dtype)
+        gallery._descriptors = descriptors
+        gallery._sq_norms = sq_norms
+        gallery._ids = ids
+        gallery._labels = np.empty(len(ids), dtype=np.int64)
+        gallery._names = names
+        gallery._size = len(ids)
+        return gallery
+
+    def load(self, conn):
+        """Replace the gallery contents with the users table"""
+        rows = conn.execute("SELECT id, name, descriptor FROM users WHERE descriptor_dim = ?",
+                            (self.dim,)).fetchall()
+        descriptors = decode_descriptors([row[2] for row in rows], self.dim)
+        with self._lock:
+            self._size = 0
+            self._names = []
+            if self._people is not None:
+                self._people = PersonGroups()
+            self.extend([row[0] for row in rows], [row[1] for row in rows], descriptors)
+
+    def set_index(self, index, path=None):
+        """Search through index, loading it from path or building it when stale"""
+        with self._lock:
+            index.attach(self)
+            if path is None or not index.load(path):
+                index.rebuild()
+                if path is not None:
+                    index.save(path)
+            self.index = index
+
+    def save_index(self, path):
+        with self._lock:
+            self.index.save(path)
+
+    def __len__(self):
+        return self._size
+
+    @property
+    def descriptors(self):
+        return self._descriptors[:self._size]
+
+    @property
+    def ids(self):
+        return self._ids[:self._size]
+
+    @property
+    def names(self):
+        return list(self._names)
+
+    def add(self, row_id, name, descriptor):
+        """Append one enrolled descriptor"""
+        with self._lock:
+            self._reserve(self._size + 1)
+            self._append(row_id, name, descriptor)
+            self.index.added(self._size - 1)
+            self.version += 1
+
+    def extend(self, row_ids, names, descriptors):
+        """Append many descriptors at once and rebuild the index"""
+        descriptors = np.asarray(descriptors, dtype=np.float64).reshape(-1, self.dim)
+        with self._lock:
+            start, end = self._size, self._size + len(descriptors)
+            self._reserve(end)
+            self._descriptors[start:end] = descriptors
+            stored = self._descriptors[start:end]
+            self._sq_norms[start:end] = np.einsum("ij,ij->i", stored, stored)
+            self._ids[start:end] = row_ids
+            self._names.extend(names)
+            if self._people is not None:
+                self._labels[start:end] = [self._people.label(n) for n in names]
+                self._people.invalidate()
+            self._size = end
+            self.index.rebuild()
+            self.version += 1
+
+    def remove_name(self, name):
+        """Drop every descriptor enrolled under name"""
+        with self._lock:
+            keep = np.array([n != name for n in self._names], dtype=bool)
+            self._compact(keep)
+
+    def remove_id(self, row_id):
+        """Drop the descriptor stored under row_id"""
+        with self._lock:
+            self._compact(self.ids != row_id)
+
+    def rename(self, old_name, new_name):
+        """Rename every descriptor enrolled under old_name"""
+        with self._lock:
+            self._names = [new_name if n == old_name else n for n in self._names]
+            if self._people is not None:
+                self._people.rename(old_name, new_name, self._labels[:self._size])
+            self.version += 1
+
+    def distances(self, descriptor, positions=None):
+        """Euclidean distance from descriptor to every row, or only to positions"""
+        q = np.asarray(descriptor, dtype=self._descriptors.dtype)
+        if positions is None:
+            rows, sq_norms = self.descriptors, self._sq_norms[:self._size]
+        else:
+            rows, sq_norms = self._descriptors[positions], self._sq_norms[positions]
+        sq = sq_norms - 2.0 * (rows @ q) + float(q @ q)
+        return np.sqrt(np.maximum(sq, 0.0))
+
+    def exact_nearest(self, descriptor):
+        """Return (position, distance) of the closest row, or (None, inf) when empty"""
+        with self._lock:
+            if self._size == 0:
+                return None, float("inf")
+            dists = self.distances(descriptor)
+            best = int(np.argmin(dists))
+            return best, float(dists[best])
+
+    def exact_nearest_many(self, descriptors):
+        """Closest row for each query with one distance matrix, positions are -1 when empty"""
+        queries = np.asarray(descriptors, dtype=self._descriptors.dtype).reshape(-1, self.dim)
+        with self._lock:
+            if self._size == 0:
+                return (np.full(len(queries), -1, dtype=np.int64),
+                        np.full(len(queries), np.inf))
+            sq = (self._sq_norms[:self._size][None, :]
+                  - 2.0 * (queries @ self.descriptors.T)
+                  + np.sum(queries ** 2, axis=1)[:, None])
+            best = np.argmin(sq, axis=1)
+            dists = np.sqrt(np.maximum(sq[np.arange(len(queries)), best], 0.0))
+            return best.astype(np.int64), dists
+
+    def exact_nearest_k(self, descriptors, k):
+        """k closest rows of each query, nearest first, positions -1 and distances inf past the size"""
+        queries = np.asarray(descriptors, dtype=self._descriptors.dtype).reshape(-1, self.dim)
+        positions = np.full((len(queries), k), -1, dtype=np.int64)
+        dists = np.full((len(queries), k), np.inf)
+        with self._lock:
+            m = min(k, self._size)
+            if m == 0:
+                return positions, dists
+            sq = (self._sq_norms[:self._size][None, :]
+                  - 2.0 * (queries @ self.descriptors.T)
+                  + np.sum(queries ** 2, axis=1)[:, None])
+            best = np.argpartition(sq, m - 1, axis=1)[:, :m]
+            best_sq = np.take_along_axis(sq, best, axis=1)
+            order = np.argsort(best_sq, axis=1)
+            positions[:, :m] = np.take_along_axis(best, order, axis=1)
+            dists[:, :m] = np.sqrt(np.maximum(np.take_along_axis(best_sq, order, axis=1), 0.0))
+            return positions, dists
+
+    def nearest(self, descriptor):
+        """Return (position, distance) of the closest row through the index"""
+        with self._lock:
+            if self._size == 0:
+                return None, float("inf")
+            return self.index.search(descriptor)
+
+    def set_aggregation(self, aggregation, top_k=MATCH_TOP_K, candidates=MATCH_CANDIDATES):
+        """Match per person instead of per row, or per row again with aggregation None
+
+        The index returns the `candidates` nearest rows of each query, and
+        the people owning them are scored against all of their exemplars:
+        "min" takes the closest exemplar, "mean" the average distance, and
+        "vote" lets the top_k closest exemplars among them vote for their
+        person.
+        """
+        if aggregation is not None and aggregation not in AGGREGATIONS:
+            raise ValueError(f"Unknown aggregation: {aggregation}")
+        with self._lock:
+            self.aggregation = aggregation
+            self.top_k = top_k
+            self.candidates = candidates
+            if aggregation is not None:
+                self.people()  # label the rows now rather than on the first match
+
+    def people(self):
+        """Person groups of the rows, labelled on first use and maintained from then on"""
+        with self._lock:
+            if self._people is None:
+                people = PersonGroups()
+                self._labels[:self._size] = [people.label(n) for n in self._names]
+                self._people = people
+            return self._people
+
+    def match(self, descriptor, threshold=0.6):
+        """Return (name, distance) of the closest row, name is None above threshold"""
+        if self.aggregation is not None:
+            return self.match_many([descriptor], threshold)[0]
+        with self._lock:
+            best, distance = self.nearest(descriptor)
+            if best is None or distance >= threshold:
+                return None, distance
+            return self._names[best], distance
+
+    def match_many(self, descriptors, threshold=0.6):
+        """Match a batch of descriptors, returns a list of (name, distance)"""
+        if len(descriptors) == 0:
+            return []
+        with self._lock:
+            if self._size == 0:
+                return [(None, float("inf"))] * len(descriptors)
+            if self.aggregation is not None:
+                return self._match_people(descriptors, threshold)
+            positions, dists = self.index.search_many(descriptors)
+            return [(self._names[p] if p >= 0 and d < threshold else None, float(d))
+                    for p, d in zip(positions, dists)]
+
+    def _match_people(self, descriptors, threshold):
+        queries = np.asarray(descriptors, dtype=np.float64).reshape(-1, self.dim)
+        people = self.people()
+        labels = self._labels[:self._size]
+        positions, _ = self.index.search_many_k(queries, self.candidates)
+
+        results = []
+        for q, nearest in zip(queries, positions):
+            candidates = list(dict.fromkeys(labels[nearest[nearest >= 0]].tolist()))
+            if not candidates:
+                results.append((None, float("inf")))
+                continue
+            groups = [people.members(c, labels) for c in candidates]
+            dists = self.distances(q, np.concatenate(groups))
+            bounds = np.cumsum([0] + [len(g) for g in groups])
+            if self.aggregation == "vote":
+                owner = np.repeat(np.arange(len(groups)), np.diff(bounds))
+                nearest = np.argsort(dists)[:self.top_k]
+                votes = np.bincount(owner[nearest], minlength=len(groups))
+                # Ties go to the person with the closest exemplar
+                best_dist = np.array([dists[bounds[i]:bounds[i + 1]].min() for i in range(len(groups))])
+                winner = min(np.flatnonzero(votes == votes.max()), key=lambda i: best_dist[i])
+                score = best_dist[winner]
+            else:
+                reduce = np.min if self.aggregation == "min" else np.mean
+                scores = np.array([reduce(dists[bounds[i]:bounds[i + 1]]) for i in range(len(groups))])
+                winner = int(np.argmin(scores))
+                score = scores[winner]
+            name = people.names[candidates[winner]]
+            results.append((name if score < threshold else None, float(score)))
+        return results
+
+    def redundant_ids(self, name, max_exemplars):
+        """Row ids to drop so that name keeps at most max_exemplars diverse exemplars
+
+        The closest pair of exemplars is found repeatedly and the one of the
+        two that is nearer, on average, to the others is dropped, so the
+        exemplars that remain cover the widest spread of captures.
+        """
+        with self._lock:
+            positions = np.array([i for i, n in enumerate(self._names) if n == name], dtype=np.int64)
+            if len(positions) <= max_exemplars:
+                return []
+            rows = self._descriptors[positions].astype(np.float64)
+            sq = np.sum(rows ** 2, axis=1)
+            pairwise = np.sqrt(np.maximum(sq[:, None] - 2.0 * (rows @ rows.T) + sq[None, :], 0.0))
+            np.fill_diagonal(pairwise, np.inf)
+            keep = list(range(len(positions)))
+            dropped = []
+            while len(keep) > max_exemplars:
+                sub = pairwise[np.ix_(keep, keep)]
+                i, j = np.unravel_index(np.argmin(sub), sub.shape)
+                finite = np.where(np.isinf(sub), 0.0, sub)
+                mean = finite.sum(axis=1) / max(len(keep) - 1, 1)
+                drop = keep[i] if mean[i] <= mean[j] else keep[j]
+                keep.remove(drop)
+                dropped.append(drop)
+            return [int(self._ids[positions[d]]) for d in dropped]
+
+    def _append(self, row_id, name, descriptor):
+        i = self._size
+        self._descriptors[i] = descriptor
+        self._sq_norms[i] = self._descriptors[i] @ self._descriptors[i]
+        self._ids[i] = row_id
+        self._names.append(name)
+        if self._people is not None:
+            self._labels[i] = self._people.label(name)
+            self._people.added(self._labels[i], i)
+        self._size += 1
+
+    def _reserve(self, needed):
+        capacity = len(self._ids)
+        if needed <= capacity:
+            return
+        capacity = max(needed, capacity * 2)
+        for attr in ("_descriptors", "_sq_norms", "_ids", "_labels"):
+            old = getattr(self, attr)
+            new = np.empty((capacity,) + old.shape[1:], dtype=old.dtype)
+            new[:self._size] = old[:self._size]
+            setattr(self, attr, new)
+
+    def _compact(self, keep):
+        n = int(keep.sum())
+        if n == self._size:
+            return
+        self._descriptors[:n] = self.descriptors[keep]
+        self._sq_norms[:n] = self._sq_norms[:self._size][keep]
+        self._ids[:n] = self.ids[keep]
+        self._labels[:n] = self._labels[:self._size][keep]
+        self._names = [name for name, k in zip(self._names, keep) if k]
+        if self._people is not None:
+            self._people.invalidate()
+        self._size = n
+        self.index.compacted(keep)
+        self.version += 1
@@ -0,0 +1,273 @@
+import os
+import sys
+import time
+import sqlite3
+import numpy as np
+
+
+class FlatIndex:
+    """Exact nearest-neighbour search over every gallery row"""
+
+    kind = "flat"
+
+    def __init__(self):
+        self.gallery = None
+
+    def attach(self, gallery):
+        self.gallery = gallery
+
+    def rebuild(self):
+        pass
+
+    def added(self, position):
+        pass
+
+    def compacted(self, keep):
+        pass
+
+    def search(self, descriptor):
+        """Return (position, distance) of the closest row"""
+        return self.gallery.exact_nearest(descriptor)
+
+    def search_many(self, descriptors):
+        """Return closest positions and distances for a batch of queries"""
+        return self.gallery.exact_nearest_many(descriptors)
+
+    def search_many_k(self, descriptors, k):
+        """k closest positions and distances per query, nearest first, padded with -1/inf"""
+        return self.gallery.exact_nearest_k(descriptors, k)
+
+    def save(self, path):
+        pass
+
+    def load(self, path):
+        return True
+
+    @property
+    def nbytes(self):
+        """Memory held by the index on top of the gallery matrix"""
+        return 0
+
+
+class IVFIndex(FlatIndex):
+    """Approximate search over k-means partitions of the gallery
+
+    Only the nprobe partitions whose centroids are closest to the query are
+    scanned, so nprobe trades recall for latency. Galleries smaller than
+    min_size are searched exactly.
+    """
+
+    kind = "ivf"
+
+    def __init__(self, n_lists=None, nprobe=8, min_size=2000, iterations=10, seed=0):
+        super().__init__()
+        self.n_lists = n_lists
+        self.nprobe = nprobe
+        self.min_size = min_size
+        self.iterations = iterations
+        self.seed = seed
+        self.centroids = None
+        self.assignments = np.empty(0, dtype=np.int32)
+        self.lists = []
+
+    @property
+    def trained(self):
+        return self.centroids is not None
+
+    def rebuild(self):
+        """Run k-means over the gallery and rebuild the inverted lists"""
+        data = self.gallery.descriptors
+        if len(data) == 0 or len(data) < self.min_size:
+            self.centroids = None
+            return
+        n_lists = min(self.n_lists or max(1, int(np.sqrt(len(data)))), len(data))
+        self.centroids = kmeans(data, n_lists, self.iterations, self.seed)
+        self.assignments = assign(data, self.centroids)
+        self._build_lists()
+
+    def added(self, position):
+        if not self.trained:
+            if len(self.gallery) >= self.min_size:
+                self.rebuild()
+            return
+        vector = self.gallery.descriptors[position:position + 1]
+        cluster = assign(vector, self.centroids)[0]
+        self.assignments = np.append(self.assignments, cluster)
+        self.lists[cluster] = np.append(self.lists[cluster], position)
+
+    def compacted(self, keep):
+        if not self.trained:
+            return
+        self.assignments = self.assignments[keep]
+        self._build_lists()
+
+    def search(self, descriptor):
+        if not self.trained:
+            return self.gallery.exact_nearest(descriptor)
+        q = np.asarray(descriptor, dtype=np.float64)
+        candidates = self._probe(q)
+        if len(candidates) == 0:
+            return None, float("inf")
+        dists = self.gallery.distances(q, candidates)
+        best = int(np.argmin(dists))
+        return int(candidates[best]), float(dists[best])
+
+    def search_many_k(self, descriptors, k):
+        if not self.trained:
+            return self.gallery.exact_nearest_k(descriptors, k)
+        queries = np.asarray(descriptors, dtype=np.float64).reshape(-1, self.gallery.dim)
+        positions = np.full((len(queries), k), -1, dtype=np.int64)
+        dists = np.full((len(queries), k), np.inf)
+        for i, q in enumerate(queries):
+            candidates = self._probe(q)
+            best, best_dists = smallest_k(self.gallery.distances(q, candidates), k)
+            m = len(best)
+            positions[i, :m], dists[i, :m] = candidates[best], best_dists
+        return positions, dists
+
+    def _probe(self, q):
+        """Gallery positions in the nprobe partitions closest to q"""
+        centroid_dists = np.sum((self.centroids - q) ** 2, axis=1)
+        nprobe = min(self.nprobe, len(self.centroids))
+        probes = np.argpartition(centroid_dists, nprobe - 1)[:nprobe]
+        return np.concatenate([self.lists[c] for c in probes])
+
+    def search_many(self, descriptors):
+        if not self.trained:
+            return self.gallery.exact_nearest_many(descriptors)
+        results = [self.search(q) for q in descriptors]
+        positions = np.array([-1 if p is None else p for p, _ in results], dtype=np.int64)
+        return positions, np.array([d for _, d in results], dtype=np.float64)
+
+    def save(self, path):
+        """Persist centroids and assignments so startup can skip k-means"""
+        if not self.trained:
+            if os.path.exists(path):
+                os.remove(path)
+            return
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "wb") as f:
+            np.savez(f, centroids=self.centroids, assignments=self.assignments,
+                     ids=self.gallery.ids)
+        os.replace(tmp_path, path)
+
+    def load(self, path):
+        """Load a saved index, returns False when it is missing or stale"""
+        if not os.path.exists(path):
+            return False
+        try:
+            with np.load(path) as data:
+                ids = data["ids"]
+                if not np.array_equal(ids, self.gallery.ids):
+                    return False
+                self.centroids = data["centroids"]
+                self.assignments = data["assignments"]
+        except (OSError, KeyError, ValueError):
+            return False
+        self._build_lists()
+        return True
+
+    def _build_lists(self):
+        order = np.argsort(self.assignments, kind="stable")
+        bounds = np.searchsorted(self.assignments[order], np.arange(len(self.centroids) + 1))
+        self.lists = [order[bounds[i]:bounds[i + 1]] for i in range(len(self.centroids))]
+
+    @property
+    def nbytes(self):
+        if not self.trained:
+            return 0
+        return self.centroids.nbytes + self.assignments.nbytes + sum(l.nbytes for l in self.lists)
+
+
+INDEX_BACKENDS = {
+    "flat": FlatIndex,
+    "ivf": IVFIndex,
+}
+
+
+def create_index(kind="flat", **options):
+    """Create an index backend by name"""
+    if kind not in INDEX_BACKENDS:
+        raise ValueError(f"Unknown index backend: {kind}")
+    return INDEX_BACKENDS[kind](**options)
+
+
+def index_path_for(db_path):
+    """Index file stored next to the users database"""
+    return os.path.splitext(db_path)[0] + ".index.npz"
+
+
+def smallest_k(dists, k):
+    """Indices and values of the k smallest entries of a 1-d array, in increasing order"""
+    k = min(k, len(dists))
+    if k == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0)
+    best = np.argpartition(dists, k - 1)[:k]
+    best = best[np.argsort(dists[best])]
+    return best, dists[best]
+
+
+def assign(data, centroids, chunk=8192):
+    """Index of the closest centroid for every row of data"""
+    c_norms = np.sum(centroids ** 2, axis=1)
+    out = np.empty(len(data), dtype=np.int32)
+    for start in range(0, len(data), chunk):
+        block = data[start:start + chunk]
+        out[start:start + chunk] = np.argmin(c_norms - 2.0 * (block @ centroids.T), axis=1)
+    return out
+
+
+def kmeans(data, k, iterations=10, seed=0):
+    """Plain Lloyd's k-means returning the centroid matrix"""
+    rng = np.random.default_rng(seed)
+    centroids = data[rng.choice(len(data), size=k, replace=False)].astype(np.float64)
+    for _ in range(iterations):
+        labels = assign(data, centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, labels, data)
+        counts = np.bincount(labels, minlength=k)
+        empty = counts == 0
+        centroids[~empty] = sums[~empty] / counts[~empty, None]
+        if empty.any():
+            centroids[empty] = data[rng.choice(len(data), size=int(empty.sum()), replace=False)]
+    return centroids
+
+
+def recall_report(gallery, index, n_queries=200, noise=0.02, seed=0):
+    """Compare an index against the exact scan on perturbed gallery rows"""
+    rng = np.random.default_rng(seed)
+    picks = rng.choice(len(gallery), size=min(n_queries, len(gallery)), replace=False)
+    queries = gallery.descriptors[picks] + rng.normal(0.0, noise, (len(picks), gallery.dim))
+
+    start = time.perf_counter()
+    exact = [gallery.exact_nearest(q)[0] for q in queries]
+    exact_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    approx = [index.search(q)[0] for q in queries]
+    approx_time = time.perf_counter() - start
+
+    hits = sum(1 for a, b in zip(exact, approx) if a == b)
+    return {
+        "backend": index.kind,
+        "gallery_size": len(gallery),
+        "queries": len(queries),
+        "recall_at_1": hits / len(queries),
+        "exact_ms": 1000.0 * exact_time / len(queries),
+        "index_ms": 1000.0 * approx_time / len(queries),
+    }
+
+
+if __name__ == "__main__":
+    from face_gallery import FaceGallery
+
+    db_path = sys.argv[1] if len(sys.argv) > 1 else "users_dlib.db"
+    gallery = FaceGallery.from_connection(sqlite3.connect(db_path))
+    index = IVFIndex(min_size=0)
+    gallery.set_index(index)
+    for nprobe in (1, 2, 4, 8, 16, 32):
+        index.nprobe = nprobe
+        report = recall_report(gallery, index)
+        print(f"nprobe={nprobe:<3} recall@1={report['recall_at_1']:.3f} "
+              f"exact={report['exact_ms']:.3f}ms ivf={report['index_ms']:.3f}ms "
+              f"(n={report['gallery_size']})")
@@ -0,0 +1,79 @@
+import time
+import cv2
+import numpy as np
+
+SHARPNESS_REFERENCE = 100.0  # Laplacian variance of a crisp face crop
+SIZE_REFERENCE = 150         # Face width in pixels that scores full marks
+
+
+def sharpness(crop):
+    """Variance of the Laplacian of a BGR crop, low for blurred or defocused faces"""
+    if crop is None or crop.size == 0:
+        return 0.0
+    gray = cv2.cvtColor(crop, cv2.COLOR_BGR2GRAY)
+    return float(cv2.Laplacian(gray, cv2.CV_64F).var())
+
+
+def frontalness(shape):
+    """1.0 for a frontal, level face, falling towards 0 with yaw and roll
+
+    Uses the 68-point landmarks: yaw from how far the nose tip sits off the
+    midpoint between the eyes, roll from the angle of the eye line. Without
+    landmarks (faces analyzed by the model server) the pose is not scored.
+    """
+    if shape is None or shape.num_parts < 68:
+        return 1.0
+    points = np.array([(shape.part(i).x, shape.part(i).y) for i in range(68)], dtype=np.float64)
+    left_eye, right_eye = points[36:42].mean(axis=0), points[42:48].mean(axis=0)
+    interocular = np.linalg.norm(right_eye - left_eye)
+    if interocular == 0:
+        return 0.0
+    nose = points[30]
+    yaw = abs((nose[0] - left_eye[0]) - (right_eye[0] - nose[0])) / interocular
+    roll = abs(np.arctan2(right_eye[1] - left_eye[1], right_eye[0] - left_eye[0]))
+    return float(max(0.0, 1.0 - yaw) * max(0.0, np.cos(roll)))
+
+
+def quality(face):
+    """Enrollment score of a FaceMatch in [0, 1] from sharpness, pose and size"""
+    sharp = min(1.0, sharpness(face.crop) / SHARPNESS_REFERENCE)
+    size = min(1.0, face.box.width() / SIZE_REFERENCE)
+    return sharp * size * frontalness(face.shape)
+
+
+class BurstCapture:
+    """Collects the largest face of successive results and keeps the best few
+
+    offer() is called with every recognition result during the burst; the
+    burst ends after `frames` distinct embeddings or `duration` seconds,
+    whichever comes first, and best() returns the `keep` highest scoring
+    faces.
+    """
+
+    def __init__(self, frames=10, duration=1.0, keep=3):
+        self.frames = frames
+        self.duration = duration
+        self.keep = keep
+        self.started = time.perf_counter()
+        self.candidates = []
+        self._seen = set()
+
+    def offer(self, faces):
+        if not faces or self.done:
+            return
+        face = max(faces, key=lambda f: f.box.area())
+        # Tracked faces repeat the cached descriptor between embeddings
+        key = id(face.descriptor)
+        if face.descriptor is None or key in self._seen:
+            return
+        self._seen.add(key)
+        self.candidates.append((quality(face), face))
+
+    @property
+    def done(self):
+        return (len(self.candidates) >= self.frames
+                or time.perf_counter() - self.started >= self.duration)
+
+    def best(self):
+        ranked = sorted(self.candidates, key=lambda c: c[0], reverse=True)
+        return [face for _, face in ranked[:self.keep]]
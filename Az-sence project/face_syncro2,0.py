@@ -1,20 +1,32 @@
 import sys
 import cv2
-import dlib
 import numpy as np
-import sqlite3
 import os
-import atexit
+import time
 import platform
 import subprocess
 import datetime
-import csv
 from PyQt5.QtWidgets import (QApplication, QMainWindow, QPushButton, QLineEdit, 
-                            QLabel, QMessageBox, QListWidget, QListWidgetItem, 
+                            QLabel, QMessageBox, QListView, 
                             QVBoxLayout, QWidget, QHBoxLayout, QInputDialog, 
-                            QComboBox, QGroupBox)
+                            QComboBox, QGroupBox, QGridLayout, QDialog, QDateEdit,
+                            QTableWidget, QTableWidgetItem)
 from PyQt5.QtGui import QImage, QPixmap
-from PyQt5.QtCore import QTimer, Qt
+from PyQt5.QtCore import QDate, QObject, Qt, QTimer, pyqtSignal
+from database import DB_PATH
+from descriptor_store import DescriptorStore
+from face_gallery import MATCH_AGGREGATION, MATCH_CANDIDATES, MATCH_TOP_K, FaceGallery
+from face_index import create_index, index_path_for
+from frame_pipeline import CameraStream, InferencePool, MotionGate, render_rgb
+from recognition import analyze_frame, FaceDetector, models
+from face_tracking import FaceTracker
+from face_quality import BurstCapture
+from attendance import AttendanceSink
+from attendance_store import REPORTS, AttendanceStore
+from faces_model import FacesListModel, PixmapCache
+from model_server import ModelClient
+from perf_stats import SnapshotWriter, stages
+from repository import open_repository
 
 # Color scheme
 DARK_BLUE = "#2A2100"      # Dark golden background
@@ -24,31 +36,64 @@ WHITE = "#F5F5DC"          # Beige white
 SECONDARY_TEXT = "#8B8000" # Secondary text color
 BORDER_COLOR = "#DAA520"   # Golden border color
 
-# Initialize Dlib models
-detector = dlib.get_frontal_face_detector()
-shape_predictor = dlib.shape_predictor("shape_predictor_68_face_landmarks.dat")
-face_recognizer = dlib.face_recognition_model_v1("dlib_face_recognition_resnet_model_v1.dat")
-
-def create_connection():
-    """Create database connection"""
-    conn = sqlite3.connect("users_dlib.db")
-    cursor = conn.cursor()
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS users (
-            name TEXT,
-            descriptor BLOB,
-            image BLOB,
-            created_at TEXT
-        )
-    """)
-    cursor.execute("""
-        CREATE TABLE IF NOT EXISTS accounts (
-            username TEXT PRIMARY KEY,
-            password TEXT,
-            role TEXT
-        )
-    """)
-    return conn
+# Face index settings
+INDEX_BACKEND = "ivf"      # "flat" for exact search
+INDEX_NPROBE = 8           # IVF partitions scanned per query (higher = better recall, slower)
+GALLERY_DTYPE = np.float32 # Same as the descriptor store, np.float64 makes a private copy of it
+DESCRIPTOR_STORE = True    # Map the gallery from users_dlib.store instead of reading every row
+
+# Person matching settings (MATCH_AGGREGATION and the rest live in face_gallery.py)
+MAX_EXEMPLARS = 10         # Captures kept per person, the most redundant are dropped
+
+# Burst enrollment settings
+BURST_FRAMES = 10          # Distinct embeddings collected per burst
+BURST_SECONDS = 1.0        # Longest burst duration
+BURST_KEEP = 3             # Best captures (sharpness x pose x size) saved per burst
+
+# Camera pipeline settings
+CAMERA_SOURCES = [0]       # Device indexes or stream URLs, one video tile each
+CAMERA_FPS = 30            # Capture and display rate
+INFERENCE_WORKERS = 2      # Threads running detection and recognition, shared by all cameras
+INFERENCE_QUEUE_SIZE = 2   # Frames waiting for inference before the oldest is dropped
+
+# Motion gating (skip recognition while the scene is static)
+MOTION_GATING = True
+MOTION_IDLE_AFTER = 5.0    # Quiet seconds without faces before a camera goes idle
+MOTION_IDLE_FPS = 2        # Frames decoded and checked for motion per second while idle
+MOTION_THRESHOLD = 12      # Gray level change counted as motion on the thumbnail
+MOTION_MIN_CHANGED = 0.005 # Fraction of thumbnail pixels that must change to wake up
+MOTION_AUDIT_INTERVAL = 10 # Seconds between recognitions of an idle scene, to count missed arrivals
+
+# Tracking settings (full recognition only for new, lost or low-confidence faces)
+TRACKING_ENABLED = True
+DETECT_INTERVAL = 10       # Frames between full detections while tracking
+TRACK_MIN_CONFIDENCE = 7.0 # Correlation tracker confidence that forces re-detection
+
+# Detection settings
+DETECT_SCALE = 1.0         # HOG detection downscale; 0.5 is ~4x faster but misses faces under ~160 px
+DETECT_UPSAMPLE = 0        # HOG upsampling passes (each finds smaller faces, ~4x slower)
+DETECT_ROI_MARGIN = 0.5    # Search only around the last faces (None = always full frame)
+
+# Shared model server (run model_server.py), None = load the models in this process
+MODEL_SERVER_ADDRESS = None
+
+# Attendance settings
+AUTO_ATTENDANCE = True     # Record attendance as soon as a face is recognized
+ATTENDANCE_COOLDOWN = 300  # Seconds before the same person is logged again
+ATTENDANCE_TO_DB = True    # Also write rows to the attendance table in DB_PATH
+
+# Performance instrumentation
+PERF_OVERLAY = False       # Draw per-stage p50/p95 latencies on the video
+PERF_SNAPSHOT_PATH = None  # e.g. "perf/stages.jsonl" or "perf/stages.csv"
+PERF_SNAPSHOT_INTERVAL = 10  # Seconds between snapshots
+
+
+class PipelineSignals(QObject):
+    """Carries pipeline output from worker threads to the GUI thread"""
+    frame_ready = pyqtSignal(object, object)
+    result_ready = pyqtSignal(object)
+    models_ready = pyqtSignal(object)
+
 
 class MainWindow(QMainWindow):
     def __init__(self, current_user):
@@ -56,20 +101,61 @@ class MainWindow(QMainWindow):
         self.setWindowTitle("Face Recognition Attendance System")
         self.setGeometry(100, 100, 1200, 700)
         self.current_user = current_user
-        self.conn = create_connection()
-        self.cursor = self.conn.cursor()
+        # Writes go through the repository's writer thread, reads use this thread's read-only connection
+        self.repository = open_repository(DB_PATH)
+        self.conn = self.repository.reader()
+        self.descriptor_store = DescriptorStore(DB_PATH) if DESCRIPTOR_STORE else None
+        if self.descriptor_store:
+            self.gallery = self.descriptor_store.load_gallery(self.conn, GALLERY_DTYPE)
+        else:
+            self.gallery = FaceGallery.from_connection(self.conn, GALLERY_DTYPE)
+        self.index_path = index_path_for(DB_PATH)
+        self.gallery.set_index(create_index(INDEX_BACKEND, **self.index_options()), self.index_path)
+        self.gallery.set_aggregation(MATCH_AGGREGATION, MATCH_TOP_K, MATCH_CANDIDATES)
         self.selected_user = None
         self.current_face_image = None
         self.last_recognized_name = None
+        self.recognized_names = []
+        self.attendance = AttendanceSink(
+            repository=self.repository if ATTENDANCE_TO_DB else None,
+            cooldown=ATTENDANCE_COOLDOWN).start()
 
         # Setup UI
         self.setup_ui()
 
         # Camera setup
-        self.cap = None
-        self.timer = QTimer(self)
-        self.timer.timeout.connect(self.update_frame)
+        self.caps = []
+        self.pool = None
+        self.streams = []
+        self.face_trackers = {}
+        self.camera_faces = {}
         self.current_face_descriptor = None
+        self.signals = PipelineSignals()
+        self.signals.frame_ready.connect(self.show_frame)
+        self.signals.result_ready.connect(self.show_result)
+        self.signals.models_ready.connect(self.on_models_ready)
+        self.frame_pending = {}
+        self.tile_sizes = {}  # camera_id -> (width, height) the render threads scale frames to
+        self.burst = None
+        self.stats_timer = QTimer(self)
+        self.stats_timer.timeout.connect(self.update_camera_stats)
+        self.perf_lines = []
+        self.perf_snapshots = None
+        if PERF_SNAPSHOT_PATH:
+            self.perf_snapshots = SnapshotWriter(PERF_SNAPSHOT_PATH, PERF_SNAPSHOT_INTERVAL,
+                                                 counters=self.stream_counters).start()
+
+        self.model_client = ModelClient(MODEL_SERVER_ADDRESS) if MODEL_SERVER_ADDRESS else None
+
+        # Load and warm up the dlib models in the background after login
+        if self.model_client:
+            self.recognition_status.setText(f"Using model server at {MODEL_SERVER_ADDRESS}")
+            self.start_button.setEnabled(True)
+        elif models.ready.is_set():
+            self.on_models_ready(models.error)
+        else:
+            self.recognition_status.setText("Loading face models...")
+            models.start_background(self.signals.models_ready.emit)
 
     def setup_ui(self):
         """Initialize user interface"""
@@ -140,14 +226,19 @@ class MainWindow(QMainWindow):
         self.button_row1 = QHBoxLayout()
         self.button_row1.setSpacing(10)
         
-        self.start_button = self.create_button("Start Camera", PRIMARY_BLUE)
+        # Enabled once the face models (or the model server) are usable
+        self.start_button = self.create_button("Start Camera", PRIMARY_BLUE, enabled=False)
         self.start_button.clicked.connect(self.start_camera)
         
         self.save_button = self.create_button("Save Face", "#00CC88", enabled=False)
         self.save_button.clicked.connect(self.save_face)
+
+        self.burst_button = self.create_button("Burst Save", "#00A36C", enabled=False)
+        self.burst_button.clicked.connect(self.start_burst)
         
         self.button_row1.addWidget(self.start_button)
         self.button_row1.addWidget(self.save_button)
+        self.button_row1.addWidget(self.burst_button)
         self.control_layout.addLayout(self.button_row1)
         
                 # زرار غلق الكاميرا
@@ -158,10 +249,14 @@ class MainWindow(QMainWindow):
         self.open_csv_button = self.create_button("Open Attendance", "#4682B4")
         self.open_csv_button.clicked.connect(self.open_csv_file)
 
+        self.report_button = self.create_button("Reports", "#5F9EA0")
+        self.report_button.clicked.connect(self.show_attendance_report)
+
         self.button_row4 = QHBoxLayout()
         self.button_row4.setSpacing(10)
         self.button_row4.addWidget(self.stop_button)
         self.button_row4.addWidget(self.open_csv_button)
+        self.button_row4.addWidget(self.report_button)
         self.control_layout.addLayout(self.button_row4)
 
 
@@ -213,8 +308,11 @@ class MainWindow(QMainWindow):
         """)
         self.faces_layout = QVBoxLayout()
         
-        self.faces_list = QListWidget()
-        self.faces_list.itemClicked.connect(self.display_face)
+        self.faces_model = FacesListModel(self.conn, DB_PATH)
+        self.faces_list = QListView()
+        self.faces_list.setModel(self.faces_model)
+        self.faces_list.setUniformItemSizes(True)
+        self.faces_list.clicked.connect(self.display_face)
         self.faces_list.setStyleSheet(f"""
             background-color: #3A3000;
             color: {WHITE};
@@ -224,6 +322,17 @@ class MainWindow(QMainWindow):
                 font-size: 14pt;
         """)
         self.faces_layout.addWidget(self.faces_list)
+
+        self.face_preview = QLabel("Select a face to preview")
+        self.face_preview.setFixedHeight(220)
+        self.face_preview.setAlignment(Qt.AlignCenter)
+        self.face_preview.setStyleSheet(f"""
+            border: 1px solid {PRIMARY_BLUE};
+            background-color: black;
+            color: {WHITE};
+        """)
+        self.preview_cache = PixmapCache(max_items=50)
+        self.faces_layout.addWidget(self.face_preview)
         
         self.faces_group.setLayout(self.faces_layout)
         self.left_layout.addWidget(self.faces_group)
@@ -250,18 +359,36 @@ class MainWindow(QMainWindow):
             }}
         """)
         self.camera_layout = QVBoxLayout()
-        
-        self.video_label = QLabel()
-        self.video_label.setMinimumSize(640, 480)
-        self.video_label.setAlignment(Qt.AlignCenter)
-        self.video_label.setStyleSheet(f"""
-            border: 2px solid {BORDER_COLOR};
-            border-radius: 8px;
-            background-color: black;
-            font-family: 'Poetsen One';
+
+        # One video tile per camera source, laid out in a near-square grid
+        self.video_labels = []
+        self.camera_stats_labels = []
+        tiles = QGridLayout()
+        columns = int(np.ceil(np.sqrt(len(CAMERA_SOURCES))))
+        for camera_id in range(len(CAMERA_SOURCES)):
+            video_label = QLabel()
+            if len(CAMERA_SOURCES) == 1:
+                video_label.setMinimumSize(640, 480)
+            else:
+                video_label.setMinimumSize(320, 240)
+            video_label.setAlignment(Qt.AlignCenter)
+            video_label.setStyleSheet(f"""
+                border: 2px solid {BORDER_COLOR};
+                border-radius: 8px;
+                background-color: black;
+                font-family: 'Poetsen One';
                 font-size: 14pt;
-        """)
-        self.camera_layout.addWidget(self.video_label)
+            """)
+            stats_label = QLabel(f"Camera {camera_id + 1}")
+            stats_label.setAlignment(Qt.AlignCenter)
+            stats_label.setStyleSheet(f"color: {SECONDARY_TEXT}; font-size: 11px;")
+            row, column = divmod(camera_id, columns)
+            tiles.addWidget(video_label, 2 * row, column)
+            tiles.addWidget(stats_label, 2 * row + 1, column)
+            self.video_labels.append(video_label)
+            self.camera_stats_labels.append(stats_label)
+        self.video_label = self.video_labels[0]
+        self.camera_layout.addLayout(tiles)
         
         self.recognition_status = QLabel("Camera not started")
         self.recognition_status.setAlignment(Qt.AlignCenter)
@@ -277,6 +404,12 @@ class MainWindow(QMainWindow):
 
         self.right_layout.addStretch()
 
+    def index_options(self):
+        """Backend specific options for the face index"""
+        if INDEX_BACKEND == "ivf":
+            return {"nprobe": INDEX_NPROBE}
+        return {}
+
     def create_button(self, text, color, enabled=True):
         """Create a styled button"""
         button = QPushButton(text)
@@ -293,23 +426,76 @@ class MainWindow(QMainWindow):
         return button
 
     def start_camera(self):
-        """Start camera capture"""
-        self.cap = cv2.VideoCapture(0)
-        self.timer.start(30)
+        """Start capture on every camera source"""
+        if self.pool and self.pool.running:
+            return
+        if not self.model_client and (not models.ready.is_set() or models.error is not None):
+            return
+        # All cameras share one inference pool and the in-memory gallery
+        self.pool = InferencePool(INFERENCE_WORKERS)
+        self.pool.start()
+        self.face_trackers = {}
+        self.camera_faces = {}
+        for camera_id, source in enumerate(CAMERA_SOURCES):
+            cap = cv2.VideoCapture(source)
+            if not cap.isOpened():
+                self.camera_stats_labels[camera_id].setText(f"Camera {camera_id + 1}: cannot open {source}")
+                cap.release()
+                continue
+            analyze, sequential = self.camera_analyzer(camera_id)
+            label = self.video_labels[camera_id]
+            self.tile_sizes[camera_id] = (label.contentsRect().width(), label.contentsRect().height())
+            stream = CameraStream(
+                camera_id,
+                cap,
+                analyze,
+                self.pool,
+                render=self.render_frame,
+                on_result=self.signals.result_ready.emit,
+                queue_size=INFERENCE_QUEUE_SIZE,
+                max_fps=CAMERA_FPS,
+                sequential=sequential,
+                motion_gate=self.motion_gate())
+            stream.start()
+            self.caps.append(cap)
+            self.streams.append(stream)
+        self.stats_timer.start(1000)
         self.save_button.setEnabled(True)
+        self.burst_button.setEnabled(True)
         self.stop_button.setEnabled(True)
         self.edit_button.setEnabled(True)
 
         self.recognition_status.setText("Searching for faces...")
         
     
+    def motion_gate(self):
+        if not MOTION_GATING:
+            return None
+        return MotionGate(MOTION_IDLE_FPS, MOTION_IDLE_AFTER, MOTION_THRESHOLD, MOTION_MIN_CHANGED,
+                          audit_interval=MOTION_AUDIT_INTERVAL)
+
+    def camera_analyzer(self, camera_id):
+        """Analyze function for one camera and whether its frames must be processed in order"""
+        if self.model_client:
+            # Detection, embedding and matching happen in the shared model server
+            return lambda frame: self.model_client.analyze(frame, camera_id), False
+        # Detector ROI and tracks follow one camera's faces, so each camera has its own
+        face_detector = FaceDetector(DETECT_SCALE, DETECT_UPSAMPLE, DETECT_ROI_MARGIN)
+        if TRACKING_ENABLED:
+            # Tracking state is sequential, the pool never runs two frames of this camera at once
+            tracker = FaceTracker(self.gallery, detect_interval=DETECT_INTERVAL,
+                                  min_confidence=TRACK_MIN_CONFIDENCE,
+                                  face_detector=face_detector)
+            self.face_trackers[camera_id] = tracker
+            return tracker.process, True
+        return lambda frame: analyze_frame(frame, self.gallery, face_detector=face_detector), False
+
     def stop_camera(self):
         """Stop the camera capture"""
-        if self.cap and self.cap.isOpened():
-            self.timer.stop()     # نوقف التايمر
-            self.cap.release()    # نحرر الكاميرا
-            self.cap = None       # نعمل cap = None لتفادي أي مشاكل بعدين
-            self.video_label.clear()   # نمسح شاشة الفيديو
+        if self.pool:
+            self.stop_streams()
+            for label in self.video_labels:
+                label.clear()   # نمسح شاشة الفيديو
             self.recognition_status.setText("Camera stopped.")
             # self.save_button.setEnabled(False)
             # self.stop_button.setEnabled(False)
@@ -338,52 +524,130 @@ class MainWindow(QMainWindow):
 
 
 
-    def update_frame(self):
-        """Update camera frame"""
-        ret, frame = self.cap.read()
-        if not ret:
+    def stop_streams(self):
+        """Stop capture and inference threads and release every camera"""
+        self.stats_timer.stop()
+        for stream in self.streams:
+            stream.stop()  # نوقف خيوط الالتقاط والتعرف
+        self.pool.stop()
+        for cap in self.caps:
+            cap.release()    # نحرر الكاميرا
+        self.streams = []
+        self.caps = []
+        self.pool = None
+        self.frame_pending = {}
+
+    def update_camera_stats(self):
+        """Show capture rate, recognition rate and latency under each tile (GUI thread)"""
+        for stream in self.streams:
+            stats = stream.stats()
+            text = (f"Camera {stream.camera_id + 1}: {stats['capture_fps']:.0f} fps, "
+                    f"recognition {stats['inference_fps']:.1f}/s, {stats['latency_ms']:.0f} ms")
+            if stats["inference_failures"]:
+                text += f", {stats['inference_failures']} failed"
+            if stream.motion_gate is not None and not stats["motion_active"]:
+                text += f", idle (CPU {stats['idle_cpu_percent']:.0f}%)"
+            elif stream.motion_gate is not None and stats["wakes"]:
+                text += f", woke in {stats['wake_latency_ms']:.0f} ms"
+            self.camera_stats_labels[stream.camera_id].setText(text)
+        # Percentiles are computed here once a second, the render threads only draw the text
+        self.perf_lines = stages.summary_lines()
+        self.statusBar().showMessage("   ".join(self.perf_lines))
+
+    def stream_counters(self):
+        """Drop and failure counts and motion gating metrics of each camera, for performance snapshots"""
+        counters = {}
+        for stream in list(self.streams):
+            stats = stream.stats()
+            counters[f"camera{stream.camera_id + 1}_inference_dropped"] = stats["inference_dropped"]
+            counters[f"camera{stream.camera_id + 1}_render_dropped"] = stats["render_dropped"]
+            counters[f"camera{stream.camera_id + 1}_inference_failures"] = stats["inference_failures"]
+            if stream.motion_gate is not None:
+                for key in ("idle_seconds", "idle_cpu_percent", "wake_latency_ms", "missed_arrival_rate"):
+                    counters[f"camera{stream.camera_id + 1}_{key}"] = round(stats[key], 3)
+        return counters
+
+    def show_attendance_report(self):
+        """Open the attendance report dialog over every daily CSV"""
+        self.attendance.flush()  # so the report includes sightings still buffered
+        dialog = AttendanceReportDialog(self.attendance.directory, self)
+        dialog.exec_()
+        dialog.store.close()
+
+    def render_frame(self, stream, frame, result):
+        """Draw the latest recognition result on a frame (render thread)"""
+        # Skip the frame while this camera's previous one is still waiting for the GUI thread,
+        # which also keeps the render buffer from being overwritten before Qt has copied it
+        if self.frame_pending.get(stream.camera_id):
             return
-
-        rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        faces = detector(rgb_frame)
-        
-        if len(faces) > 0:
-            face = faces[0]
-            self.current_face_image = frame[face.top():face.bottom(), face.left():face.right()]
-            
-            shape = shape_predictor(rgb_frame, face)
-            self.current_face_descriptor = np.array(face_recognizer.compute_face_descriptor(rgb_frame, shape))
-            
-            match_name = self.find_face_match(self.current_face_descriptor)
-            
-            if match_name:
-                self.last_recognized_name = match_name
-                self.recognition_status.setText(f"Recognized: {match_name}")
-                cv2.putText(frame, match_name, (face.left(), face.top()-10), 
-                            cv2.FONT_HERSHEY_SIMPLEX, 0.9, (0,255,0), 2)
+        with stages.measure("draw"):
+            image = render_rgb(frame.image, result.value if result else [], stream.buffers,
+                               self.tile_sizes.get(stream.camera_id),
+                               self.perf_lines if PERF_OVERLAY else ())
+
+        with stages.measure("qimage"):
+            h, w, ch = image.shape
+            # Wraps the stream's RGB buffer without copying, show_frame copies it into a pixmap
+            q_img = QImage(image.data, w, h, ch * w, QImage.Format_RGB888)
+        self.frame_pending[stream.camera_id] = True
+        self.signals.frame_ready.emit(stream.camera_id, q_img)
+
+    def show_frame(self, camera_id, q_img):
+        """Show a rendered frame in its camera's video tile (GUI thread)"""
+        label = self.video_labels[camera_id]
+        if self.pool:
+            label.setPixmap(QPixmap.fromImage(q_img))
+        self.tile_sizes[camera_id] = (label.contentsRect().width(), label.contentsRect().height())
+        self.frame_pending[camera_id] = False
+
+    def show_result(self, result):
+        """Update recognition state from an inference result (GUI thread)"""
+        if not self.pool:
+            return
+        self.camera_faces[result.camera_id] = result.value
+        faces = [face for camera_faces in self.camera_faces.values() for face in camera_faces]
+        if self.burst:
+            self.burst.offer(result.value)
+            if self.burst.done:
+                self.finish_burst()
+            else:
+                self.refresh_trackers()
+        # Every recognized person in view, in order of first appearance
+        self.recognized_names = list(dict.fromkeys(f.name for f in faces if f.name))
+        self.last_recognized_name = self.recognized_names[0] if self.recognized_names else None
+        if AUTO_ATTENDANCE:
+            for name in self.recognized_names:
+                self.attendance.record(name)
+        if faces:
+            # Enrollment uses the largest (closest) face in view
+            face = max(faces, key=lambda f: f.box.area())
+            self.current_face_image = face.crop
+            self.current_face_descriptor = face.descriptor
+            unknown = sum(1 for f in faces if not f.name)
+            if self.recognized_names:
+                status = f"Recognized: {', '.join(self.recognized_names)}"
+                if unknown:
+                    status += f" (+{unknown} new)"
+                self.recognition_status.setText(status)
             else:
-                self.last_recognized_name = None
                 self.recognition_status.setText("New face - Click Save to add")
-            
-            cv2.rectangle(frame, (face.left(), face.top()), 
-                          (face.right(), face.bottom()), (0,255,0), 2)
         else:
-            self.last_recognized_name = None
             self.recognition_status.setText("Searching for faces...")
 
-        frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
-        h, w, ch = frame.shape
-        q_img = QImage(frame.data, w, h, ch * w, QImage.Format_RGB888)
-        self.video_label.setPixmap(QPixmap.fromImage(q_img))
+    def on_models_ready(self, error):
+        """Report background model loading (GUI thread)"""
+        self.start_button.setEnabled(error is None)
+        if error is not None:
+            self.recognition_status.setText("Failed to load face models")
+            QMessageBox.critical(self, "Error", f"Failed to load face models: {error}")
+        elif not self.pool:
+            total = sum(models.timings.values())
+            self.recognition_status.setText(f"Face models ready ({total:.1f}s) - Camera not started")
 
     def find_face_match(self, descriptor, threshold=0.6):
-        """Find matching face in database"""
-        self.cursor.execute("SELECT name, descriptor FROM users")
-        for name, saved_desc in self.cursor.fetchall():
-            distance = np.linalg.norm(descriptor - np.frombuffer(saved_desc, dtype=np.float64))
-            if distance < threshold:
-                return name
-        return None
+        """Find the closest enrolled face in the in-memory gallery"""
+        name, _ = self.gallery.match(descriptor, threshold)
+        return name
 
     def save_face(self):
         """Save detected face to database"""
@@ -391,89 +655,123 @@ class MainWindow(QMainWindow):
         if not name:
             name = "Unknown"
 
-        if self.current_face_image is not None:
+        # The live frame already computed this face's landmarks and descriptor on the full frame
+        if self.current_face_descriptor is not None:
             try:
-                shape = shape_predictor(
-                    cv2.cvtColor(self.current_face_image, cv2.COLOR_BGR2RGB), 
-                    detector(cv2.cvtColor(self.current_face_image, cv2.COLOR_BGR2RGB))[0]
-                )
-                descriptor = np.array(face_recognizer.compute_face_descriptor(
-                    cv2.cvtColor(self.current_face_image, cv2.COLOR_BGR2RGB), 
-                    shape
-                ))
-                
-                _, img_bytes = cv2.imencode('.jpg', self.current_face_image)
-                
-                self.cursor.execute(
-                    "INSERT INTO users (name, descriptor, image, created_at) VALUES (?, ?, ?, ?)",
-                    (name, descriptor.tobytes(), img_bytes.tobytes(), datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")))
-                self.conn.commit()
+                self.store_faces(name, [(self.current_face_image, self.current_face_descriptor)])
+                self.prune_exemplars(name)
                 QMessageBox.information(self, "Success", f"Face for {name} saved successfully!")
-                self.show_saved_faces()
             except Exception as e:
                 QMessageBox.critical(self, "Error", f"Error while saving: {str(e)}")
         else:
             QMessageBox.warning(self, "Error", "No face detected!")
 
+    def start_burst(self):
+        """Collect BURST_FRAMES captures over BURST_SECONDS and save the best BURST_KEEP"""
+        if not self.pool or self.burst:
+            return
+        self.burst = BurstCapture(BURST_FRAMES, BURST_SECONDS, BURST_KEEP)
+        self.refresh_trackers()
+        self.burst_button.setEnabled(False)
+        self.recognition_status.setText("Capturing burst - hold still...")
+        QTimer.singleShot(int(BURST_SECONDS * 1000) + 100, self.finish_burst)
+
+    def refresh_trackers(self):
+        """Make every tracker embed its faces again so a burst sees fresh descriptors"""
+        for tracker in self.face_trackers.values():
+            tracker.refresh()
+
+    def finish_burst(self):
+        if not self.burst:
+            return
+        faces, self.burst = self.burst.best(), None
+        self.burst_button.setEnabled(self.pool is not None)
+        if not faces:
+            QMessageBox.warning(self, "Error", "No face detected!")
+            return
+        name = self.name_input.text() or "Unknown"
+        try:
+            self.store_faces(name, [(face.crop, face.descriptor) for face in faces])
+            self.prune_exemplars(name)
+            QMessageBox.information(self, "Success", f"{len(faces)} captures of {name} saved successfully!")
+        except Exception as e:
+            QMessageBox.critical(self, "Error", f"Error while saving: {str(e)}")
+
+    def store_faces(self, name, captures):
+        """Insert (crop, descriptor) captures and add them to the gallery, the store log and the faces list"""
+        created_at = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+        # Queued together, the writer commits the whole burst at once
+        pending = []
+        for crop, descriptor in captures:
+            _, img_bytes = cv2.imencode('.jpg', crop)
+            pending.append((descriptor, self.repository.add_user(name, descriptor, img_bytes.tobytes(), created_at)))
+        for descriptor, future in pending:
+            user_id, before, after = future.result()
+            self.gallery.add(user_id, name, descriptor)
+            self.log_user_change(before, after, "add", user_id, name, descriptor)
+            if self.model_client:
+                self.model_client.add(user_id, name, descriptor)
+            self.faces_model.user_added(user_id, name, created_at)
+
+    def prune_exemplars(self, name):
+        """Keep at most MAX_EXEMPLARS diverse captures of name"""
+        pending = [(user_id, self.repository.remove_id(user_id))
+                   for user_id in self.gallery.redundant_ids(name, MAX_EXEMPLARS)]
+        for user_id, future in pending:
+            _, before, after = future.result()
+            self.gallery.remove_id(user_id)
+            self.log_user_change(before, after, "remove_id", user_id)
+            if self.model_client:
+                self.model_client.remove_id(user_id)
+            self.faces_model.user_removed(user_id)
+            self.preview_cache.discard(user_id)
+
     def mark_attendance(self):
-        """Mark attendance for recognized face"""
-        if not self.last_recognized_name:
+        """Mark attendance for every recognized face in view"""
+        names = list(self.recognized_names)
+        if not names:
             QMessageBox.warning(self, "Error", "No recognized face to mark attendance!")
             return
-            
-        timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-        date = datetime.datetime.now().strftime("%Y-%m-%d")
-        
-        # Create attendance directory if not exists
-        if not os.path.exists("attendance"):
-            os.makedirs("attendance")
-            
-        # Create or append to CSV file
-        filename = f"attendance/attendance_{date}.csv"
-        file_exists = os.path.isfile(filename)
-        
+
+        marked = [name for name in names if self.attendance.record(name)]
         try:
-            with open(filename, mode='a', newline='') as file:
-                writer = csv.writer(file)
-                if not file_exists:
-                    writer.writerow(["Name", "Timestamp"])
-                writer.writerow([self.last_recognized_name, timestamp])
-                
-            QMessageBox.information(self, "Success", f"Attendance marked for {self.last_recognized_name} at {timestamp}")
+            self.attendance.flush()
         except Exception as e:
             QMessageBox.critical(self, "Error", f"Failed to mark attendance: {str(e)}")
+            return
+
+        if marked:
+            timestamp = datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S")
+            QMessageBox.information(self, "Success", f"Attendance marked for {', '.join(marked)} at {timestamp}")
+        else:
+            QMessageBox.information(self, "Info", f"Attendance already marked for {', '.join(names)}")
 
     def show_saved_faces(self):
-        """Display saved faces from database"""
-        self.faces_list.clear()
-        self.cursor.execute("SELECT name, image, created_at FROM users")
-        rows = self.cursor.fetchall()
-        for row in rows:
-            name, img_data, created_at = row
-            item = QListWidgetItem(f"{name} - {created_at}")
-            item.setData(Qt.UserRole, img_data)
-            self.faces_list.addItem(item)
-
-    def display_face(self, item):
-        """Display selected face image"""
+        """Display saved faces from database, one page at a time"""
+        self.faces_model.reload()
+
+    def display_face(self, index):
+        """Show the selected face in the preview pane"""
         try:
-            name = item.text().split(' - ')[0]
-            self.cursor.execute("SELECT image FROM users WHERE name = ?", (name,))
-            img_data = self.cursor.fetchone()[0]
-            
-            nparr = np.frombuffer(img_data, np.uint8)
-            img_np = cv2.imdecode(nparr, cv2.IMREAD_COLOR)
-            
-            temp_filename = "temp_face.jpg"
-            cv2.imwrite(temp_filename, img_np)
-            
-            if platform.system() == "Windows":
-                os.startfile(temp_filename)
-            elif platform.system() == "Darwin":
-                subprocess.call(["open", temp_filename])
-            else:
-                subprocess.call(["xdg-open", temp_filename])
-                
+            start = time.perf_counter()
+            name = index.data(Qt.DisplayRole).split(' - ')[0]
+            user_id = index.data(Qt.UserRole)
+
+            pixmap = self.preview_cache.get(user_id)
+            if pixmap is None:
+                image = self.repository.face_image(user_id)
+                if image is None:
+                    raise ValueError("no image stored for this face")
+                pixmap = QPixmap()
+                if not pixmap.loadFromData(image):
+                    raise ValueError("image data could not be decoded")
+                self.preview_cache.put(user_id, pixmap)
+
+            self.face_preview.setPixmap(pixmap.scaled(self.face_preview.size(), Qt.KeepAspectRatio,
+                                                      Qt.SmoothTransformation))
+            self.preview_ms = 1000.0 * (time.perf_counter() - start)
+            self.face_preview.setToolTip(f"{name} (preview in {self.preview_ms:.1f} ms)")
+
             self.selected_user = name
             self.delete_button.setEnabled(self.current_user["role"] == "admin")
             self.edit_button.setEnabled(self.current_user["role"] == "admin")
@@ -496,9 +794,15 @@ class MainWindow(QMainWindow):
                                    QMessageBox.Yes | QMessageBox.No, QMessageBox.No)
         
         if reply == QMessageBox.Yes:
-            self.cursor.execute("DELETE FROM users WHERE name = ?", (self.selected_user,))
-            self.conn.commit()
-            self.show_saved_faces()
+            _, before, after = self.repository.remove_name(self.selected_user).result()
+            self.gallery.remove_name(self.selected_user)
+            self.log_user_change(before, after, "remove_name", self.selected_user)
+            if self.model_client:
+                self.model_client.remove_name(self.selected_user)
+            self.faces_model.users_removed(self.selected_user)
+            # Row ids can be reused after a delete, so drop every cached preview
+            self.preview_cache.clear()
+            self.face_preview.clear()
             QMessageBox.information(self, "Success", f"User {self.selected_user} deleted!")
             self.selected_user = None
 
@@ -515,22 +819,97 @@ class MainWindow(QMainWindow):
         new_name, ok = QInputDialog.getText(self, "Edit User", "Enter new name:", 
                                           QLineEdit.Normal, self.selected_user)
         if ok and new_name:
-            self.cursor.execute("UPDATE users SET name = ? WHERE name = ?", 
-                              (new_name, self.selected_user))
-            self.conn.commit()
-            self.show_saved_faces()
+            _, before, after = self.repository.rename(self.selected_user, new_name).result()
+            self.gallery.rename(self.selected_user, new_name)
+            self.log_user_change(before, after, "rename", self.selected_user, new_name)
+            if self.model_client:
+                self.model_client.rename(self.selected_user, new_name)
+            self.faces_model.users_renamed(self.selected_user, new_name)
             QMessageBox.information(self, "Success", 
                                  f"User {self.selected_user} updated to {new_name}!")
             self.selected_user = None
 
+    def log_user_change(self, before, after, op, *args):
+        """Append a committed users change to the descriptor store log"""
+        if self.descriptor_store:
+            self.descriptor_store.append(self.conn, before, after, op, *args)
+
     def closeEvent(self, event):
         """Clean up resources on window close"""
-        if self.cap and self.cap.isOpened():
-            self.cap.release()
-        self.timer.stop()
-        self.conn.close()
+        if self.perf_snapshots:
+            self.perf_snapshots.close()  # before the streams go, to keep their drop counts
+        if self.pool:
+            self.stop_streams()
+        self.gallery.save_index(self.index_path)
+        self.attendance.close()
+        self.faces_model.close()
+        if self.descriptor_store:
+            # Fold this session's log so the next start maps the store as is
+            self.descriptor_store.compact(self.conn)
+        self.repository.close()
         event.accept()
 
+class AttendanceReportDialog(QDialog):
+    """Range and per-person attendance reports from the indexed attendance store"""
+
+    def __init__(self, directory, parent=None):
+        super().__init__(parent)
+        self.setWindowTitle("Attendance Reports")
+        self.setGeometry(150, 150, 800, 500)
+        self.store = AttendanceStore(directory)
+
+        layout = QVBoxLayout(self)
+        controls = QHBoxLayout()
+        self.report_combo = QComboBox()
+        self.report_combo.addItems(list(REPORTS))
+        today = QDate.currentDate()
+        self.from_date = QDateEdit(QDate(today.year(), today.month(), 1))
+        self.to_date = QDateEdit(today)
+        for date_edit in (self.from_date, self.to_date):
+            date_edit.setCalendarPopup(True)
+            date_edit.setDisplayFormat("yyyy-MM-dd")
+        self.person_input = QLineEdit()
+        self.person_input.setPlaceholderText("Name (person report)")
+        self.run_button = QPushButton("Run")
+        self.run_button.clicked.connect(self.run_report)
+        for widget in (self.report_combo, QLabel("From:"), self.from_date, QLabel("To:"), self.to_date,
+                       self.person_input, self.run_button):
+            controls.addWidget(widget)
+        layout.addLayout(controls)
+
+        self.table = QTableWidget()
+        layout.addWidget(self.table)
+        self.timing_label = QLabel()
+        self.timing_label.setStyleSheet(f"color: {SECONDARY_TEXT};")
+        layout.addWidget(self.timing_label)
+        self.run_report()
+
+    def run_report(self):
+        report = self.report_combo.currentText()
+        headers, query = REPORTS[report]
+        start, end = self.from_date.date().toString("yyyy-MM-dd"), self.to_date.date().toString("yyyy-MM-dd")
+        started = time.perf_counter()
+        if report == "person":
+            name = self.person_input.text().strip()
+            if not name:
+                QMessageBox.warning(self, "Error", "Enter a name for the person report!")
+                return
+            rows = query(self.store, name, start, end)
+        else:
+            rows = query(self.store, start, end)
+        elapsed = 1000.0 * (time.perf_counter() - started)
+
+        self.table.clear()
+        self.table.setColumnCount(len(headers))
+        self.table.setHorizontalHeaderLabels(headers)
+        self.table.setRowCount(len(rows))
+        for r, row in enumerate(rows):
+            for c, value in enumerate(row):
+                self.table.setItem(r, c, QTableWidgetItem(str(value)))
+        self.table.resizeColumnsToContents()
+        self.timing_label.setText(f"{len(rows)} rows in {elapsed:.1f} ms")
+
+
 class LoginWindow(QMainWindow):
     def __init__(self):
         super().__init__()
@@ -636,14 +1015,9 @@ class LoginWindow(QMainWindow):
                 QMessageBox.warning(self, "Error", "Please enter both username and password")
                 return
 
-            conn = None
             try:
-                conn = create_connection()
-                cursor = conn.cursor()
+                result = open_repository(DB_PATH).find_account(username, password)
 
-                cursor.execute("SELECT * FROM accounts WHERE username = ? AND password = ?", (username, password))
-                result = cursor.fetchone()
-                
                 if result:
                     self.current_user = {"username": username, "role": result[2]}
                     QMessageBox.information(self, "Success", "Login successful!")
@@ -654,9 +1028,6 @@ class LoginWindow(QMainWindow):
                     QMessageBox.warning(self, "Error", "Invalid username or password!")
             except Exception as e:
                 QMessageBox.critical(self, "Error", f"Database error: {e}")
-            finally:
-                if conn:
-                    conn.close()
         except Exception as e:
             QMessageBox.critical(self, "Error", f"Unexpected error: {e}")
 
@@ -671,36 +1042,17 @@ class LoginWindow(QMainWindow):
                 QMessageBox.warning(self, "Error", "Please fill all fields!")
                 return
 
-            conn = None
             try:
-                conn = create_connection()
-                cursor = conn.cursor()
-
-                cursor.execute("SELECT * FROM accounts WHERE username = ?", (username,))
-                result = cursor.fetchone()
-
-                if result:
+                if not open_repository(DB_PATH).add_account(username, password, role).result():
                     QMessageBox.warning(self, "Error", "Username already exists!")
                 else:
-                    cursor.execute("INSERT INTO accounts (username, password, role) VALUES (?, ?, ?)", 
-                                (username, password, role))
-                    conn.commit()
                     QMessageBox.information(self, "Success", "Account created successfully!")
 
             except Exception as e:
                 QMessageBox.critical(self, "Error", f"Database error: {e}")
-            finally:
-                if conn:
-                    conn.close()
         except Exception as e:
             QMessageBox.critical(self, "Error", f"Unexpected error: {e}")   
             
-@atexit.register
-def cleanup():
-    """Clean up temporary files on exit"""
-    if os.path.exists("temp_face.jpg"):
-        os.remove("temp_face.jpg")          
-        
 if __name__ == "__main__":
 
     app = QApplication(sys.argv)
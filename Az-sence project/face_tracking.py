@@ -0,0 +1,168 @@
+import threading
+import cv2
+import dlib
+from perf_stats import stages
+from recognition import FaceDetector, FaceMatch, crop_face, embed_faces
+
+
+def box_iou(a, b):
+    """Intersection over union of two dlib rectangles"""
+    left, top = max(a.left(), b.left()), max(a.top(), b.top())
+    right, bottom = min(a.right(), b.right()), min(a.bottom(), b.bottom())
+    inter = max(0, right - left) * max(0, bottom - top)
+    union = a.width() * a.height() + b.width() * b.height() - inter
+    return inter / union if union > 0 else 0.0
+
+
+def to_rectangle(position):
+    """Round a tracker drectangle to an integer dlib rectangle"""
+    return dlib.rectangle(int(position.left()), int(position.top()),
+                          int(position.right()), int(position.bottom()))
+
+
+class Track:
+    """A face followed across frames with its cached identity and descriptor"""
+
+    def __init__(self, track_id, rgb_frame, box):
+        self.track_id = track_id
+        self.tracker = dlib.correlation_tracker()
+        self.box = box
+        self.confidence = float("inf")
+        self.shape = None
+        self.descriptor = None
+        self.name = None
+        self.distance = float("inf")
+        self.frames_since_embed = 0
+        self.restart(rgb_frame, box)
+
+    def restart(self, rgb_frame, box):
+        self.tracker.start_track(rgb_frame, box)
+        self.box = box
+        self.confidence = float("inf")
+
+    def update(self, rgb_frame):
+        self.confidence = self.tracker.update(rgb_frame)
+        self.box = to_rectangle(self.tracker.get_position())
+        self.frames_since_embed += 1
+        return self.confidence
+
+
+class FaceTracker:
+    """Runs full detection periodically and correlation tracking in between
+
+    A face keeps the identity and descriptor computed when its track was
+    created. Landmarks and the embedding are recomputed only for new tracks,
+    for tracks whose tracker confidence fell below min_confidence, and for
+    tracks older than reembed_interval frames.
+    """
+
+    def __init__(self, gallery, threshold=0.6, detect_interval=10, min_confidence=7.0,
+                 reembed_interval=90, iou_threshold=0.3, max_faces=None, face_detector=None):
+        self.gallery = gallery
+        self.face_detector = face_detector or FaceDetector()
+        self.threshold = threshold
+        self.detect_interval = detect_interval
+        self.min_confidence = min_confidence
+        self.reembed_interval = reembed_interval
+        self.iou_threshold = iou_threshold
+        self.max_faces = max_faces
+        self.tracks = []
+        self._next_track_id = 0
+        self._frames_since_detect = 0
+        self._gallery_version = gallery.version
+        self._lock = threading.Lock()
+        self.frames = 0
+        self.detections = 0
+        self.embeddings = 0
+
+    def process(self, frame):
+        """Return a FaceMatch for every tracked face in a BGR frame"""
+        with self._lock:
+            with stages.measure("bgr2rgb"):
+                rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+            self.frames += 1
+            self._frames_since_detect += 1
+
+            weak = set()
+            with stages.measure("track"):
+                for track in self.tracks:
+                    if track.update(rgb_frame) < self.min_confidence:
+                        weak.add(track.track_id)
+
+            if not self.tracks or weak or self._frames_since_detect >= self.detect_interval:
+                self._detect(rgb_frame, weak)
+
+            if self.gallery.version != self._gallery_version:
+                # Users were enrolled, renamed or deleted: re-match cached descriptors
+                self._gallery_version = self.gallery.version
+                tracks = [t for t in self.tracks if t.descriptor is not None]
+                matches = self.gallery.match_many([t.descriptor for t in tracks], self.threshold)
+                for track, (name, distance) in zip(tracks, matches):
+                    track.name, track.distance = name, distance
+
+            return [FaceMatch(t.box, t.shape, t.descriptor, t.name, t.distance,
+                              crop_face(frame, t.box)) for t in self.tracks]
+
+    def reset(self):
+        with self._lock:
+            self.tracks = []
+
+    def refresh(self):
+        """Detect and re-embed every face on the next frame instead of reusing cached descriptors"""
+        with self._lock:
+            self._frames_since_detect = self.detect_interval
+            for track in self.tracks:
+                track.frames_since_embed = self.reembed_interval
+
+    def stats(self):
+        """Detections and face embeddings per processed frame"""
+        frames = max(self.frames, 1)
+        return {
+            "frames": self.frames,
+            "detect_ratio": self.detections / frames,
+            "embed_ratio": self.embeddings / frames,
+            "tracks": len(self.tracks),
+        }
+
+    def _detect(self, rgb_frame, weak):
+        self.detections += 1
+        self._frames_since_detect = 0
+        boxes = self.face_detector.detect(rgb_frame)[:self.max_faces]
+
+        # Greedy IoU association between existing tracks and fresh detections
+        pairs = sorted(((box_iou(t.box, b), i, j) for i, t in enumerate(self.tracks)
+                        for j, b in enumerate(boxes)), reverse=True)
+        matched_tracks, matched_boxes, kept, stale = set(), set(), [], []
+        for iou, i, j in pairs:
+            if iou < self.iou_threshold or i in matched_tracks or j in matched_boxes:
+                continue
+            matched_tracks.add(i)
+            matched_boxes.add(j)
+            track = self.tracks[i]
+            track.restart(rgb_frame, boxes[j])
+            if track.track_id in weak or track.frames_since_embed >= self.reembed_interval:
+                stale.append(track)
+            kept.append(track)
+
+        for j, box in enumerate(boxes):
+            if j not in matched_boxes:
+                track = Track(self._next_track_id, rgb_frame, box)
+                self._next_track_id += 1
+                stale.append(track)
+                kept.append(track)
+
+        self._embed(rgb_frame, stale)
+        self.tracks = kept
+
+    def _embed(self, rgb_frame, tracks):
+        """Embed and match new or stale tracks in one batch"""
+        if not tracks:
+            return
+        self.embeddings += len(tracks)
+        shapes, descriptors = embed_faces(rgb_frame, [t.box for t in tracks])
+        with stages.measure("match"):
+            matches = self.gallery.match_many(descriptors, self.threshold)
+        for track, shape, descriptor, (name, distance) in zip(tracks, shapes, descriptors, matches):
+            track.shape, track.descriptor = shape, descriptor
+            track.name, track.distance = name, distance
+            track.frames_since_embed = 0
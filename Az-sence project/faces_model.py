@@ -0,0 +1,209 @@
+import logging
+import queue
+import threading
+from bisect import bisect_left
+from collections import OrderedDict
+import cv2
+import numpy as np
+from PyQt5.QtCore import QAbstractListModel, QModelIndex, QObject, QSize, Qt, pyqtSignal
+from PyQt5.QtGui import QImage, QPixmap
+from database import read_only_connection
+from perf_stats import stages
+
+PAGE_SIZE = 100
+THUMBNAIL_SIZE = 48
+
+log = logging.getLogger(__name__)
+
+
+class PixmapCache:
+    """Least-recently-used cache of decoded images keyed by user id"""
+
+    def __init__(self, max_items=500):
+        self.max_items = max_items
+        self._items = OrderedDict()
+
+    def get(self, user_id):
+        pixmap = self._items.get(user_id)
+        if pixmap is not None:
+            self._items.move_to_end(user_id)
+        return pixmap
+
+    def put(self, user_id, pixmap):
+        self._items[user_id] = pixmap
+        self._items.move_to_end(user_id)
+        while len(self._items) > self.max_items:
+            self._items.popitem(last=False)
+
+    def discard(self, user_id):
+        self._items.pop(user_id, None)
+
+    def clear(self):
+        self._items.clear()
+
+
+class ThumbnailLoader(QObject):
+    """Loads and decodes face thumbnails on a background thread"""
+
+    thumbnail_ready = pyqtSignal(int, QImage)
+
+    def __init__(self, db_path, size=THUMBNAIL_SIZE):
+        super().__init__()
+        self.db_path = db_path
+        self.size = size
+        # Newest requests first: they belong to the rows currently on screen
+        self._requests = queue.LifoQueue()
+        self._pending = set()
+        self._lock = threading.Lock()
+        self._thread = threading.Thread(target=self._run, name="thumbnails", daemon=True)
+        self._thread.start()
+
+    def request(self, user_id):
+        with self._lock:
+            if user_id in self._pending:
+                return
+            self._pending.add(user_id)
+        self._requests.put(user_id)
+
+    def stop(self):
+        self._requests.put(None)
+
+    def _run(self):
+        conn = read_only_connection(self.db_path)
+        while True:
+            user_id = self._requests.get()
+            if user_id is None:
+                break
+            try:
+                row = conn.execute("SELECT image FROM face_images WHERE user_id = ?", (user_id,)).fetchone()
+                if row is not None:
+                    self.thumbnail_ready.emit(user_id, self.decode(row[0]))
+            except Exception as e:
+                # The row keeps its placeholder icon
+                stages.count("thumbnail_failures")
+                log.warning("Failed to load thumbnail %s: %s", user_id, e)
+            finally:
+                with self._lock:
+                    self._pending.discard(user_id)
+        conn.close()
+
+    def decode(self, img_data):
+        """Decode a JPEG blob into a small RGB QImage"""
+        # Reduced decode lets libjpeg skip most of the work for large photos
+        image = cv2.imdecode(np.frombuffer(img_data, np.uint8), cv2.IMREAD_REDUCED_COLOR_2)
+        h, w = image.shape[:2]
+        scale = self.size / max(h, w)
+        if scale < 1.0:
+            image = cv2.resize(image, (max(int(w * scale), 1), max(int(h * scale), 1)),
+                               interpolation=cv2.INTER_AREA)
+        image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)
+        h, w, ch = image.shape
+        return QImage(image.data, w, h, ch * w, QImage.Format_RGB888).copy()
+
+
+class FacesListModel(QAbstractListModel):
+    """Saved faces fetched from the users table a page at a time as the view scrolls"""
+
+    def __init__(self, conn, db_path, page_size=PAGE_SIZE, cache_size=500):
+        super().__init__()
+        self.conn = conn
+        self.page_size = page_size
+        self.rows = []
+        self.last_id = 0
+        self.exhausted = False
+        self.cache = PixmapCache(cache_size)
+        self.loader = ThumbnailLoader(db_path)
+        self.loader.thumbnail_ready.connect(self.thumbnail_loaded)
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.rows)
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        user_id, name, created_at = self.rows[index.row()]
+        if role == Qt.DisplayRole:
+            return f"{name} - {created_at}"
+        if role == Qt.UserRole:
+            return user_id
+        if role == Qt.DecorationRole:
+            pixmap = self.cache.get(user_id)
+            if pixmap is None:
+                self.loader.request(user_id)
+            return pixmap
+        if role == Qt.SizeHintRole:
+            return QSize(0, THUMBNAIL_SIZE + 4)
+        return None
+
+    def canFetchMore(self, parent=QModelIndex()):
+        return not parent.isValid() and not self.exhausted
+
+    def fetchMore(self, parent=QModelIndex()):
+        if parent.isValid():
+            return
+        # Keyset pagination stays fast however far the list is scrolled
+        page = self.conn.execute("SELECT id, name, created_at FROM users WHERE id > ? ORDER BY id LIMIT ?",
+                                 (self.last_id, self.page_size)).fetchall()
+        if len(page) < self.page_size:
+            self.exhausted = True
+        if not page:
+            return
+        self.beginInsertRows(QModelIndex(), len(self.rows), len(self.rows) + len(page) - 1)
+        self.rows.extend(page)
+        self.last_id = page[-1][0]
+        self.endInsertRows()
+
+    def reload(self):
+        """Drop every loaded row and start again from the first page"""
+        self.beginResetModel()
+        self.rows = []
+        self.last_id = 0
+        self.exhausted = False
+        self.endResetModel()
+        self.fetchMore()
+
+    def user_added(self, user_id, name, created_at):
+        """Show a newly enrolled user without reloading the list"""
+        if not self.exhausted:
+            return  # it will arrive with a later page
+        self.beginInsertRows(QModelIndex(), len(self.rows), len(self.rows))
+        self.rows.append((user_id, name, created_at))
+        self.last_id = max(self.last_id, user_id)
+        self.endInsertRows()
+
+    def users_removed(self, name):
+        """Remove every loaded row enrolled under name"""
+        for row in range(len(self.rows) - 1, -1, -1):
+            if self.rows[row][1] == name:
+                self.beginRemoveRows(QModelIndex(), row, row)
+                self.cache.discard(self.rows[row][0])
+                del self.rows[row]
+                self.endRemoveRows()
+
+    def user_removed(self, user_id):
+        """Remove the loaded row of one user id"""
+        row = bisect_left(self.rows, (user_id,))
+        if row < len(self.rows) and self.rows[row][0] == user_id:
+            self.beginRemoveRows(QModelIndex(), row, row)
+            self.cache.discard(user_id)
+            del self.rows[row]
+            self.endRemoveRows()
+
+    def users_renamed(self, old_name, new_name):
+        """Rename every loaded row enrolled under old_name"""
+        for row, (user_id, name, created_at) in enumerate(self.rows):
+            if name == old_name:
+                self.rows[row] = (user_id, new_name, created_at)
+                index = self.index(row)
+                self.dataChanged.emit(index, index, [Qt.DisplayRole])
+
+    def thumbnail_loaded(self, user_id, image):
+        self.cache.put(user_id, QPixmap.fromImage(image))
+        # Rows are kept in id order
+        row = bisect_left(self.rows, (user_id,))
+        if row < len(self.rows) and self.rows[row][0] == user_id:
+            index = self.index(row)
+            self.dataChanged.emit(index, index, [Qt.DecorationRole])
+
+    def close(self):
+        self.loader.stop()
@@ -0,0 +1,514 @@
+import logging
+import time
+import threading
+from collections import deque
+import cv2
+import numpy as np
+from perf_stats import stages
+
+log = logging.getLogger(__name__)
+
+
+class DropOldestQueue:
+    """Bounded queue that discards the oldest item instead of blocking the producer"""
+
+    def __init__(self, maxsize):
+        self._items = deque()
+        self._maxsize = maxsize
+        self._cond = threading.Condition()
+        self._closed = False
+        self.dropped = 0
+
+    def put(self, item):
+        with self._cond:
+            if len(self._items) >= self._maxsize:
+                self._items.popleft()
+                self.dropped += 1
+            self._items.append(item)
+            self._cond.notify()
+
+    def get(self, timeout=None):
+        """Return the oldest item, or None when closed or timed out"""
+        with self._cond:
+            if not self._items and not self._closed:
+                self._cond.wait(timeout)
+            if not self._items:
+                return None
+            return self._items.popleft()
+
+    def pop(self):
+        """Return the oldest item without waiting, or None when empty"""
+        with self._cond:
+            return self._items.popleft() if self._items else None
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def __len__(self):
+        with self._cond:
+            return len(self._items)
+
+
+class RateMeter:
+    """Events per second over a sliding time window"""
+
+    def __init__(self, window=2.0):
+        self.window = window
+        self._times = deque()
+        self._lock = threading.Lock()
+        self.count = 0
+
+    def tick(self):
+        now = time.perf_counter()
+        with self._lock:
+            self.count += 1
+            self._times.append(now)
+            while self._times and now - self._times[0] > self.window:
+                self._times.popleft()
+
+    @property
+    def rate(self):
+        now = time.perf_counter()
+        with self._lock:
+            while self._times and now - self._times[0] > self.window:
+                self._times.popleft()
+            return len(self._times) / self.window
+
+
+class Frame:
+    """A captured frame tagged with its sequence number and capture time"""
+
+    def __init__(self, frame_id, image, captured_at=None):
+        self.frame_id = frame_id
+        self.image = image
+        self.captured_at = captured_at if captured_at is not None else time.perf_counter()
+
+
+class Result:
+    """Output of the analyze stage for one frame"""
+
+    def __init__(self, frame, value):
+        self.frame_id = frame.frame_id
+        self.captured_at = frame.captured_at
+        self.completed_at = time.perf_counter()
+        self.value = value
+
+    @property
+    def latency(self):
+        return self.completed_at - self.captured_at
+
+
+class MotionGate:
+    """Decides which captured frames of an idle scene are worth analyzing
+
+    Every frame is reduced to a small blurred grayscale thumbnail and
+    compared with the previous one. While pixels change, or while the last
+    results still contained faces (a person standing still), the stream is
+    active: every frame is analyzed at the full rate. After `idle_after`
+    quiet seconds it goes idle: frames are decoded and scored at `idle_fps`,
+    only shown, and the first frame with motion wakes it straight back to
+    full rate.
+
+    An idle stream still analyzes one frame every `audit_interval` seconds.
+    Faces found by such an audit are arrivals the differencing missed; they
+    are counted and wake the stream. Wake latency is measured from the grab
+    of the waking frame to its result; idle CPU is the process CPU
+    time spent while this stream was idle, so with several cameras it is
+    only meaningful once all of them are.
+    """
+
+    def __init__(self, idle_fps=2, idle_after=5.0, threshold=12, min_changed=0.005,
+                 thumbnail=(32, 24), audit_interval=10.0):
+        self.idle_interval = 1.0 / idle_fps
+        self.idle_after = idle_after
+        self.threshold = threshold
+        self.min_changed = min_changed
+        self.thumbnail = thumbnail
+        self.audit_interval = audit_interval
+        self.active = True
+        self.wakes = 0
+        self.audits = 0
+        self.missed_arrivals = 0
+        self.idle_seconds = 0.0
+        self.idle_cpu_seconds = 0.0
+        self.wake_latency = 0.0
+        self._previous = None
+        self._last_activity = time.perf_counter()
+        self._last_audit = self._last_activity
+        self._clock = None  # (wall, cpu) of the previous idle poll
+        self._waking_frame = None
+        self._audit_frames = set()
+        self._lock = threading.Lock()
+
+    def motion(self, image):
+        """Fraction of thumbnail pixels that changed since the previous frame"""
+        h, w = image.shape[:2]
+        # Striding first keeps the resize cost independent of the camera resolution
+        step = max(1, min(w // (4 * self.thumbnail[0]), h // (4 * self.thumbnail[1])))
+        small = cv2.resize(image[::step, ::step], self.thumbnail, interpolation=cv2.INTER_AREA)
+        gray = cv2.GaussianBlur(cv2.cvtColor(small, cv2.COLOR_BGR2GRAY), (3, 3), 0)
+        previous, self._previous = self._previous, gray
+        if previous is None:
+            return 1.0
+        return np.count_nonzero(cv2.absdiff(gray, previous) > self.threshold) / gray.size
+
+    def admit(self, frame):
+        """Whether a captured frame should be analyzed, updating the idle state"""
+        with stages.measure("motion"):
+            moving = self.motion(frame.image) >= self.min_changed
+        now = time.perf_counter()
+        with self._lock:
+            if not self.active:
+                wall, cpu = now, time.process_time()
+                if self._clock is not None:
+                    self.idle_seconds += wall - self._clock[0]
+                    self.idle_cpu_seconds += cpu - self._clock[1]
+                self._clock = (wall, cpu)
+            if moving:
+                self._last_activity = now
+                if not self.active:
+                    self._wake(frame)
+                return True
+            if self.active:
+                if now - self._last_activity < self.idle_after:
+                    return True
+                self.active = False
+                self._clock = None
+                self._last_audit = now
+                stages.count("motion_idle")
+            if now - self._last_audit >= self.audit_interval:
+                self._last_audit = now
+                self.audits += 1
+                self._audit_frames.add(frame.frame_id)
+                return True
+            return False
+
+    def observe(self, result):
+        """Feed back an inference result: faces keep the stream awake"""
+        with self._lock:
+            if self._waking_frame is not None and result.frame_id >= self._waking_frame:
+                self._waking_frame = None
+                self.wake_latency = result.latency
+                stages.record("wake_latency", result.latency)
+            audited = result.frame_id in self._audit_frames
+            self._audit_frames.discard(result.frame_id)
+            if not result.value:
+                return
+            self._last_activity = time.perf_counter()
+            if audited and not self.active:
+                self.active = True
+                self.missed_arrivals += 1
+                stages.count("missed_arrivals")
+
+    def _wake(self, frame):
+        self.active = True
+        self.wakes += 1
+        self._waking_frame = frame.frame_id
+        stages.count("motion_wakes")
+
+    @property
+    def interval(self):
+        """Seconds between captures, None for the stream's own frame rate"""
+        return None if self.active else self.idle_interval
+
+    def stats(self):
+        with self._lock:
+            arrivals = self.wakes + self.missed_arrivals
+            return {
+                "motion_active": self.active,
+                "idle_seconds": self.idle_seconds,
+                "idle_cpu_percent": 100.0 * self.idle_cpu_seconds / self.idle_seconds if self.idle_seconds else 0.0,
+                "wake_latency_ms": 1000.0 * self.wake_latency,
+                "wakes": self.wakes,
+                "missed_arrivals": self.missed_arrivals,
+                "missed_arrival_rate": self.missed_arrivals / arrivals if arrivals else 0.0,
+            }
+
+
+class InferencePool:
+    """Worker threads shared by every camera stream
+
+    Workers serve the streams round-robin, starting after the stream served
+    last, so a camera with a constant backlog cannot starve the others.
+    Streams marked sequential (e.g. with tracking state) never have two of
+    their frames analyzed at once.
+    """
+
+    def __init__(self, workers=2):
+        self.workers = workers
+        self.streams = []
+        self._cond = threading.Condition()
+        self._next = 0
+        self._running = threading.Event()
+        self._threads = []
+
+    def start(self):
+        self._running.set()
+        self._threads = [threading.Thread(target=self._worker_loop, name=f"inference-{i}", daemon=True)
+                         for i in range(self.workers)]
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self):
+        self._running.clear()
+        with self._cond:
+            self._cond.notify_all()
+        for thread in self._threads:
+            thread.join(timeout=2.0)
+        self._threads = []
+
+    @property
+    def running(self):
+        return self._running.is_set()
+
+    def add(self, stream):
+        with self._cond:
+            self.streams.append(stream)
+
+    def remove(self, stream):
+        with self._cond:
+            if stream in self.streams:
+                self.streams.remove(stream)
+
+    def notify(self):
+        with self._cond:
+            self._cond.notify()
+
+    def _take(self):
+        """Next (stream, frame) in round-robin order, or None when stopping"""
+        with self._cond:
+            while self._running.is_set():
+                n = len(self.streams)
+                for k in range(n):
+                    i = (self._next + k) % n
+                    stream = self.streams[i]
+                    if stream.sequential and stream.busy:
+                        continue
+                    frame = stream.inference_queue.pop()
+                    if frame is not None:
+                        self._next = (i + 1) % n
+                        stream.busy = True
+                        return stream, frame
+                self._cond.wait(0.1)
+        return None
+
+    def _worker_loop(self):
+        while True:
+            task = self._take()
+            if task is None:
+                return
+            stream, frame = task
+            try:
+                with stages.measure("inference"):
+                    value = stream.analyze(frame.image)
+                stream.deliver(Result(frame, value))
+            except Exception:
+                stages.count("inference_failures")
+                stream.inference_failures += 1
+                if stream.inference_failures == 1:
+                    # Later failures are only counted, a broken analyzer would log every frame
+                    log.exception("Inference failed on camera %s", stream.camera_id)
+            finally:
+                with self._cond:
+                    stream.busy = False
+                    self._cond.notify_all()
+
+
+class FrameBuffers:
+    """Named arrays reused from frame to frame by one render thread
+
+    get() only allocates when the requested shape changes (first frame,
+    resolution or tile size change), counting it as render_allocations.
+    """
+
+    def __init__(self):
+        self._arrays = {}
+        self.allocations = 0
+
+    def get(self, name, shape, dtype=np.uint8):
+        array = self._arrays.get(name)
+        if array is None or array.shape != shape or array.dtype != dtype:
+            array = self._arrays[name] = np.empty(shape, dtype)
+            self.allocations += 1
+            stages.count("render_allocations")
+        return array
+
+
+def render_rgb(image, faces, buffers, size=None, lines=()):
+    """Draw faces and text lines on an RGB copy of a BGR frame held in buffers
+
+    The frame is downscaled into the "scaled" buffer when `size` (width,
+    height of the video tile) is smaller, then converted once into the "rgb"
+    buffer, and boxes are drawn there in RGB colors. The source frame is
+    left untouched, it is still shared with the inference queue.
+    """
+    h, w = image.shape[:2]
+    scale = min(size[0] / w, size[1] / h) if size is not None else 1.0
+    if scale >= 0.95:
+        scale = 1.0  # near-native and larger tiles show the frame as it is, Qt centers it
+    else:
+        width, height = max(int(w * scale), 1), max(int(h * scale), 1)
+        scaled = buffers.get("scaled", (height, width, 3))
+        cv2.resize(image, (width, height), dst=scaled, interpolation=cv2.INTER_LINEAR)
+        image = scaled
+    rgb = buffers.get("rgb", image.shape)
+    cv2.cvtColor(image, cv2.COLOR_BGR2RGB, dst=rgb)
+
+    for face in faces:
+        box = face.box
+        left, top = int(box.left() * scale), int(box.top() * scale)
+        right, bottom = int(box.right() * scale), int(box.bottom() * scale)
+        if face.name:
+            cv2.putText(rgb, face.name, (left, top - 10), cv2.FONT_HERSHEY_SIMPLEX, 0.9, (0,255,0), 2)
+        cv2.rectangle(rgb, (left, top), (right, bottom), (0,255,0), 2)
+    for i, line in enumerate(lines):
+        cv2.putText(rgb, line, (10, 20 + 18 * i), cv2.FONT_HERSHEY_SIMPLEX, 0.5, (255,255,0), 1)
+    return rgb
+
+
+class CameraStream:
+    """Capture thread and render thread for one camera, feeding a shared InferencePool
+
+    Every captured frame goes to the render stage, which draws it with the
+    most recent recognition result, and to a bounded inference queue. Both
+    queues drop the oldest frame when full, so a slow detector lowers the
+    recognition rate without lowering the display rate. With a MotionGate,
+    frames of a static scene are only shown, at the gate's idle rate.
+
+    The capture thread grabs every frame at the camera's own rate and only
+    decodes the ones that are due (max_fps, or the idle rate). Sleeping
+    between reads instead would leave frames queued in the driver (V4L2
+    keeps 4 buffers) or the network stream, and every read would return one
+    that is seconds old. Frames are stamped when grabbed, so latencies
+    include any time spent in those queues.
+    """
+
+    def __init__(self, camera_id, capture, analyze, pool, render=None, on_result=None,
+                 queue_size=2, max_fps=30, sequential=False, motion_gate=None):
+        self.camera_id = camera_id
+        self.capture = capture
+        self.analyze = analyze
+        self.pool = pool
+        self.render = render
+        self.on_result = on_result
+        self.sequential = sequential
+        self.motion_gate = motion_gate
+        self.busy = False
+        self.frame_interval = 1.0 / max_fps if max_fps else 0.0
+
+        self.inference_queue = DropOldestQueue(queue_size)
+        self.render_queue = DropOldestQueue(1)
+        self.capture_rate = RateMeter()
+        self.inference_rate = RateMeter()
+        self.render_rate = RateMeter()
+        self.buffers = FrameBuffers()
+
+        self.latest_result = None
+        self._result_lock = threading.Lock()
+        self._running = threading.Event()
+        self._threads = []
+        self.last_latency = 0.0
+        self.read_failures = 0
+        self.inference_failures = 0
+
+    def start(self):
+        self._running.set()
+        self.pool.add(self)
+        self._threads = [threading.Thread(target=self._capture_loop, name=f"capture-{self.camera_id}",
+                                          daemon=True)]
+        if self.render is not None:
+            self._threads.append(threading.Thread(target=self._render_loop, name=f"render-{self.camera_id}",
+                                                  daemon=True))
+        for thread in self._threads:
+            thread.start()
+
+    def stop(self):
+        self._running.clear()
+        self.pool.remove(self)
+        self.inference_queue.close()
+        self.render_queue.close()
+        for thread in self._threads:
+            thread.join(timeout=2.0)
+        self._threads = []
+
+    @property
+    def running(self):
+        return self._running.is_set()
+
+    def stats(self):
+        """Snapshot of stage rates, drop counts and recognition latency"""
+        return {
+            "camera": self.camera_id,
+            "capture_fps": self.capture_rate.rate,
+            "inference_fps": self.inference_rate.rate,
+            "render_fps": self.render_rate.rate,
+            "inference_dropped": self.inference_queue.dropped,
+            "render_dropped": self.render_queue.dropped,
+            "inference_failures": self.inference_failures,
+            "latency_ms": 1000.0 * self.last_latency,
+            **(self.motion_gate.stats() if self.motion_gate is not None else {}),
+        }
+
+    def deliver(self, result):
+        """Called by the pool when a frame of this stream has been analyzed"""
+        result.camera_id = self.camera_id
+        self.inference_rate.tick()
+        if self.motion_gate is not None:
+            self.motion_gate.observe(result)
+        with self._result_lock:
+            # Workers can finish out of order, keep only the newest frame's result
+            if self.latest_result is not None and self.latest_result.frame_id > result.frame_id:
+                return
+            self.latest_result = result
+            self.last_latency = result.latency
+        stages.record("end_to_end", result.latency)
+        if self.on_result is not None:
+            self.on_result(result)
+
+    def capture_interval(self):
+        """Seconds between decoded frames at the current (idle or full) rate"""
+        interval = self.motion_gate.interval if self.motion_gate is not None else None
+        return interval or self.frame_interval
+
+    def _capture_loop(self):
+        frame_id = 0
+        next_due = time.perf_counter()
+        while self._running.is_set():
+            with stages.measure("capture"):
+                grabbed = self.capture.grab()
+            grabbed_at = time.perf_counter()
+            if not grabbed:
+                self.read_failures += 1
+                time.sleep(0.01)
+                continue
+            # Half an interval of slack so camera jitter does not skip a frame at max_fps
+            if grabbed_at < next_due - 0.5 * self.capture_interval():
+                continue  # grabbed only to keep the driver queue fresh
+            with stages.measure("decode"):
+                ret, image = self.capture.retrieve()
+            if not ret:
+                self.read_failures += 1
+                continue
+            frame = Frame(frame_id, image, grabbed_at)
+            frame_id += 1
+            self.capture_rate.tick()
+            if self.motion_gate is None or self.motion_gate.admit(frame):
+                self.inference_queue.put(frame)
+                self.pool.notify()
+            self.render_queue.put(frame)
+
+            # After admit(), so a wake returns to the full rate from the next frame
+            next_due = max(next_due + self.capture_interval(), grabbed_at)
+
+    def _render_loop(self):
+        while self._running.is_set():
+            frame = self.render_queue.get(timeout=0.1)
+            if frame is None:
+                continue
+            with self._result_lock:
+                result = self.latest_result
+            with stages.measure("render"):
+                self.render(self, frame, result)
+            self.render_rate.tick()
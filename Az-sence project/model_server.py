@@ -0,0 +1,347 @@
+"""Shared recognition service that owns the dlib models and the face gallery
+
+    python model_server.py --db users_dlib.db
+
+Camera windows and kiosks on the same machine connect as clients
+(MODEL_SERVER_ADDRESS in face_syncro2,0.py) and send frames or face crops.
+Requests from every client are collected into micro-batches: each batch is
+embedded with one batched compute_face_descriptor call and matched with one
+gallery operation, so adding a camera costs a client connection rather than
+another copy of the networks.
+
+Connections carry pickled objects, so only processes of the same user may
+connect: the socket lives in the per-user runtime directory and every
+start writes a random key to a 0600 file next to it, which clients read
+to authenticate.
+"""
+import argparse
+import os
+import platform
+import queue
+import stat
+import tempfile
+import threading
+import time
+import uuid
+from multiprocessing import AuthenticationError
+from multiprocessing.connection import Client, Listener
+import cv2
+import dlib
+import numpy as np
+from face_gallery import AGGREGATIONS, MATCH_AGGREGATION
+
+
+def runtime_dir():
+    """Directory only the current user can access, XDG_RUNTIME_DIR when set"""
+    path = os.environ.get("XDG_RUNTIME_DIR")
+    if path:
+        return path
+    path = os.path.join(tempfile.gettempdir(), f"face_syncro-{os.getuid()}")
+    try:
+        os.mkdir(path, 0o700)
+    except FileExistsError:
+        pass
+    info = os.lstat(path)
+    if not stat.S_ISDIR(info.st_mode) or info.st_uid != os.getuid() or info.st_mode & 0o077:
+        raise RuntimeError(f"{path} is not a private directory of this user")
+    return path
+
+
+def default_address():
+    if platform.system() == "Windows":
+        return r"\\.\pipe\face_syncro_models"
+    return os.path.join(runtime_dir(), "face_syncro_models.sock")
+
+
+def authkey_path(address):
+    """File holding the key of the server at address"""
+    if platform.system() == "Windows":
+        return os.path.join(os.path.expanduser("~"), ".face_syncro_models.key")
+    return address + ".key"
+
+
+def write_authkey(path):
+    """Write a new random key readable only by this user, returns it"""
+    key = os.urandom(32)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    fd = os.open(tmp_path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    with os.fdopen(fd, "wb") as f:
+        f.write(key)
+    os.replace(tmp_path, path)
+    return key
+
+
+def read_authkey(path):
+    try:
+        with open(path, "rb") as f:
+            return f.read()
+    except FileNotFoundError:
+        raise RuntimeError(f"No model server key at {path}, is model_server.py running?") from None
+
+
+class Request:
+    """One frame or crop waiting for the batcher"""
+
+    def __init__(self, image, boxes=None):
+        self.image = image
+        self.boxes = boxes
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class ModelServer:
+    """Serves detect/embed/match requests from many clients with micro-batching"""
+
+    def __init__(self, address, db_path, threshold=0.6, max_batch=8, max_wait=0.005,
+                 scale=1.0, upsample=0, aggregation=MATCH_AGGREGATION):
+        from database import create_connection
+        from descriptor_store import DescriptorStore
+        from recognition import FaceDetector, models
+
+        self.address = address
+        self.db_path = db_path
+        self.threshold = threshold
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.models = models
+        self.scale = scale
+        self.upsample = upsample
+        self.face_detector_class = FaceDetector
+
+        models.warm_up()
+        conn = create_connection(db_path)
+        self.gallery = DescriptorStore(db_path).load_gallery(conn)
+        self.gallery.set_aggregation(aggregation)
+        conn.close()
+
+        self.requests = queue.Queue()
+        self.batches = 0
+        self.batched_requests = 0
+        self.clients = 0
+        self._detectors = {}
+        self._detectors_lock = threading.Lock()
+        self._running = threading.Event()
+
+    def serve_forever(self):
+        self._running.set()
+        threading.Thread(target=self._batch_loop, name="batcher", daemon=True).start()
+        windows = platform.system() == "Windows"
+        if not windows and os.path.lexists(self.address):
+            if not stat.S_ISSOCK(os.lstat(self.address).st_mode):
+                raise RuntimeError(f"{self.address} exists and is not a socket, refusing to remove it")
+            os.remove(self.address)  # stale socket from a previous run
+        authkey = write_authkey(authkey_path(self.address))
+        with Listener(self.address, authkey=authkey) as listener:
+            if not windows:
+                os.chmod(self.address, 0o600)
+            print(f"Model server listening on {self.address} ({len(self.gallery)} faces)")
+            while self._running.is_set():
+                try:
+                    conn = listener.accept()
+                except AuthenticationError:
+                    continue  # a process without the key, keep serving the others
+                threading.Thread(target=self._handle, args=(conn,), daemon=True).start()
+
+    def _handle(self, conn):
+        self.clients += 1
+        cameras = set()  # detectors this connection holds
+        try:
+            while True:
+                op, *args = conn.recv()
+                try:
+                    conn.send(("ok", self._dispatch(op, args, cameras)))
+                except Exception as e:
+                    conn.send(("error", str(e)))
+        except (EOFError, OSError):
+            pass
+        finally:
+            self._release_detectors(cameras)
+            self.clients -= 1
+            conn.close()
+
+    def _detector(self, camera, cameras):
+        """Detector of one client camera, held by the connection owning `cameras`
+
+        A client's pool threads share its connections across cameras, so the
+        detector (and its ROI state) is keyed by the camera each frame names,
+        not by the connection it arrives on. It is dropped once no open
+        connection has sent a frame of that camera.
+        """
+        with self._detectors_lock:
+            entry = self._detectors.get(camera)
+            if entry is None:
+                entry = self._detectors[camera] = [self.face_detector_class(self.scale, self.upsample), 0]
+            if camera not in cameras:
+                cameras.add(camera)
+                entry[1] += 1
+            return entry[0]
+
+    def _release_detectors(self, cameras):
+        with self._detectors_lock:
+            for camera in cameras:
+                entry = self._detectors[camera]
+                entry[1] -= 1
+                if not entry[1]:
+                    del self._detectors[camera]
+
+    def _dispatch(self, op, args, cameras):
+        if op == "analyze":
+            frame, camera = args
+            boxes = self._detector(camera, cameras).detect(cv2.cvtColor(frame, cv2.COLOR_BGR2RGB))
+            return self._submit(frame, boxes)
+        if op == "embed":
+            crop, = args
+            h, w = crop.shape[:2]
+            return self._submit(crop, [dlib.rectangle(0, 0, w - 1, h - 1)])
+        if op == "add":
+            self.gallery.add(*args)
+            return None
+        if op == "remove_name":
+            self.gallery.remove_name(*args)
+            return None
+        if op == "remove_id":
+            self.gallery.remove_id(*args)
+            return None
+        if op == "rename":
+            self.gallery.rename(*args)
+            return None
+        if op == "stats":
+            return self.stats()
+        raise ValueError(f"Unknown operation: {op}")
+
+    def _submit(self, image, boxes):
+        if not boxes:
+            return []
+        request = Request(image, boxes)
+        self.requests.put(request)
+        request.done.wait()
+        if request.error is not None:
+            raise request.error
+        return request.result
+
+    def stats(self):
+        return {
+            "clients": self.clients,
+            "batches": self.batches,
+            "mean_batch_size": self.batched_requests / self.batches if self.batches else 0.0,
+            "gallery_size": len(self.gallery),
+        }
+
+    def _batch_loop(self):
+        while self._running.is_set():
+            batch = [self.requests.get()]
+            deadline = time.perf_counter() + self.max_wait
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.perf_counter()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self.requests.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            try:
+                self._process(batch)
+            except Exception as e:
+                for request in batch:
+                    request.error = e
+            for request in batch:
+                request.done.set()
+
+    def _process(self, batch):
+        """Landmark every request, embed all faces in one call, match them in one call"""
+        images, shapes = [], []
+        for request in batch:
+            rgb = cv2.cvtColor(request.image, cv2.COLOR_BGR2RGB)
+            detections = dlib.full_object_detections()
+            for box in request.boxes:
+                detections.append(self.models.shape_predictor(rgb, box))
+            images.append(rgb)
+            shapes.append(detections)
+
+        per_image = self.models.face_recognizer.compute_face_descriptor(images, shapes)
+        descriptors = np.array([np.array(d) for faces in per_image for d in faces])
+        matches = self.gallery.match_many(descriptors, self.threshold)
+
+        offset = 0
+        for request in batch:
+            n = len(request.boxes)
+            request.result = [((b.left(), b.top(), b.right(), b.bottom()), descriptors[offset + i], name, distance)
+                              for i, (b, (name, distance)) in enumerate(zip(request.boxes, matches[offset:offset + n]))]
+            offset += n
+        self.batches += 1
+        self.batched_requests += len(batch)
+
+
+class ModelClient:
+    """Client side of the model server, one connection per calling thread"""
+
+    def __init__(self, address=None):
+        self.address = address or default_address()
+        self.client_id = uuid.uuid4().hex
+        self._local = threading.local()
+
+    def _call(self, op, *args):
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            # Read on every connect, the server writes a new key each time it starts
+            authkey = read_authkey(authkey_path(self.address))
+            conn = self._local.conn = Client(self.address, authkey=authkey)
+        conn.send((op,) + args)
+        status, value = conn.recv()
+        if status != "ok":
+            raise RuntimeError(f"Model server error: {value}")
+        return value
+
+    def analyze(self, frame, camera_id=0):
+        """Detect, embed and match every face in a BGR frame of camera_id on the server"""
+        from recognition import FaceMatch, crop_face
+        faces = []
+        for box, descriptor, name, distance in self._call("analyze", frame, (self.client_id, camera_id)):
+            rect = dlib.rectangle(*box)
+            faces.append(FaceMatch(rect, None, descriptor, name, distance, crop_face(frame, rect)))
+        return faces
+
+    def embed(self, crop):
+        """Descriptor of a tightly cropped BGR face image"""
+        return self._call("embed", crop)[0][1]
+
+    def add(self, user_id, name, descriptor):
+        self._call("add", user_id, name, descriptor)
+
+    def remove_name(self, name):
+        self._call("remove_name", name)
+
+    def remove_id(self, user_id):
+        self._call("remove_id", user_id)
+
+    def rename(self, old_name, new_name):
+        self._call("rename", old_name, new_name)
+
+    def stats(self):
+        return self._call("stats")
+
+
+def main():
+    from database import DB_PATH
+
+    parser = argparse.ArgumentParser(description="Shared face recognition model server")
+    parser.add_argument("--address", default=default_address(), help="Unix socket path or Windows pipe name")
+    parser.add_argument("--db", default=DB_PATH, help="users database")
+    parser.add_argument("--threshold", type=float, default=0.6, help="match distance threshold")
+    parser.add_argument("--max-batch", type=int, default=8, help="requests embedded together")
+    parser.add_argument("--max-wait-ms", type=float, default=5.0, help="time to wait for a batch to fill")
+    parser.add_argument("--scale", type=float, default=1.0, help="detection downscale factor")
+    parser.add_argument("--upsample", type=int, default=0, help="HOG upsampling passes")
+    parser.add_argument("--aggregation", choices=list(AGGREGATIONS) + ["none"], default=MATCH_AGGREGATION or "none",
+                        help="match per person over their exemplars, none for the closest row")
+    args = parser.parse_args()
+
+    server = ModelServer(args.address, args.db, args.threshold, args.max_batch,
+                         args.max_wait_ms / 1000.0, args.scale, args.upsample,
+                         None if args.aggregation == "none" else args.aggregation)
+    server.serve_forever()
+
+
+if __name__ == "__main__":
+    main()
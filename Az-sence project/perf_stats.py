@@ -0,0 +1,159 @@
+import csv
+import datetime
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+import numpy as np
+
+log = logging.getLogger(__name__)
+
+
+class LatencyHistogram:
+    """Rolling window of the most recent durations of one stage"""
+
+    def __init__(self, window=1000):
+        self._samples = deque(maxlen=window)
+        self.count = 0
+        self.total = 0.0
+
+    def add(self, seconds):
+        self._samples.append(seconds)
+        self.count += 1
+        self.total += seconds
+
+    def summary(self):
+        """Count, mean and p50/p95/p99 of the window in milliseconds"""
+        if not self._samples:
+            return {"count": self.count, "mean_ms": 0.0, "p50_ms": 0.0, "p95_ms": 0.0, "p99_ms": 0.0}
+        samples = 1000.0 * np.fromiter(self._samples, dtype=np.float64, count=len(self._samples))
+        p50, p95, p99 = np.percentile(samples, (50, 95, 99))
+        return {"count": self.count, "mean_ms": float(samples.mean()),
+                "p50_ms": float(p50), "p95_ms": float(p95), "p99_ms": float(p99)}
+
+
+class StageStats:
+    """Per-stage latency histograms and event counters shared by every thread
+
+    Stages are named by the code that measures them (capture, bgr2rgb,
+    detect, landmark, embed, match, track, draw, qimage, db_write, ...).
+    Recording a sample is a lock and a deque append, cheap enough for every
+    frame; percentiles are only computed when a snapshot is taken.
+    """
+
+    def __init__(self, window=1000):
+        self.window = window
+        self.enabled = True
+        self._stages = {}
+        self._counters = {}
+        self._lock = threading.Lock()
+
+    def record(self, stage, seconds):
+        if not self.enabled:
+            return
+        with self._lock:
+            histogram = self._stages.get(stage)
+            if histogram is None:
+                histogram = self._stages[stage] = LatencyHistogram(self.window)
+            histogram.add(seconds)
+
+    @contextmanager
+    def measure(self, stage):
+        """Time the body of a with block as one sample of stage"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(stage, time.perf_counter() - start)
+
+    def count(self, name, n=1):
+        with self._lock:
+            self._counters[name] = self._counters.get(name, 0) + n
+
+    def reset(self):
+        with self._lock:
+            self._stages = {}
+            self._counters = {}
+
+    def snapshot(self):
+        """Dict with a summary of every stage and the current counter values"""
+        with self._lock:
+            stages = {name: histogram.summary() for name, histogram in self._stages.items()}
+            counters = dict(self._counters)
+        return {"time": datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+                "stages": stages, "counters": counters}
+
+    def summary_lines(self, stages=None):
+        """One 'stage p50/p95 ms' line per stage for overlays and status bars"""
+        snapshot = self.snapshot()["stages"]
+        return [f"{name} {s['p50_ms']:.1f}/{s['p95_ms']:.1f} ms"
+                for name, s in snapshot.items() if stages is None or name in stages]
+
+
+stages = StageStats()
+
+
+class SnapshotWriter:
+    """Appends a stats snapshot to a .jsonl or .csv file every `interval` seconds
+
+    `counters` is an optional callable returning extra counters, e.g. the
+    dropped frame counts of the camera queues, merged into each snapshot.
+    """
+
+    CSV_FIELDS = ["time", "name", "count", "mean_ms", "p50_ms", "p95_ms", "p99_ms"]
+
+    def __init__(self, path, interval=10.0, stats=stages, counters=None):
+        self.path = path
+        self.interval = interval
+        self.stats = stats
+        self.counters = counters
+        self._closed = threading.Event()
+        self._thread = None
+
+    def start(self):
+        self._thread = threading.Thread(target=self._run, name="perf-snapshots", daemon=True)
+        self._thread.start()
+        return self
+
+    def close(self):
+        self._closed.set()
+        if self._thread is not None:
+            self._thread.join(timeout=2.0)
+        self.write()
+
+    def write(self):
+        snapshot = self.stats.snapshot()
+        if self.counters is not None:
+            snapshot["counters"].update(self.counters())
+        directory = os.path.dirname(self.path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        if self.path.endswith(".csv"):
+            self._write_csv(snapshot)
+        else:
+            with open(self.path, mode="a") as file:
+                file.write(json.dumps(snapshot) + "\n")
+
+    def _write_csv(self, snapshot):
+        file_exists = os.path.isfile(self.path)
+        with open(self.path, mode="a", newline="") as file:
+            writer = csv.writer(file)
+            if not file_exists:
+                writer.writerow(self.CSV_FIELDS)
+            for name, s in snapshot["stages"].items():
+                writer.writerow([snapshot["time"], name, s["count"], f"{s['mean_ms']:.3f}",
+                                 f"{s['p50_ms']:.3f}", f"{s['p95_ms']:.3f}", f"{s['p99_ms']:.3f}"])
+            for name, value in snapshot["counters"].items():
+                writer.writerow([snapshot["time"], name, value, "", "", "", ""])
+
+    def _run(self):
+        while not self._closed.wait(self.interval):
+            try:
+                self.write()
+            except Exception as e:
+                # Retried at the next interval, the counter shows up in the snapshot that succeeds
+                self.stats.count("snapshot_failures")
+                log.warning("Failed to write performance snapshot: %s", e)
@@ -0,0 +1,211 @@
+import threading
+import time
+import cv2
+import dlib
+import numpy as np
+from perf_stats import stages
+
+LANDMARKS_MODEL = "shape_predictor_68_face_landmarks.dat"
+RECOGNITION_MODEL = "dlib_face_recognition_resnet_model_v1.dat"
+
+
+class ModelRegistry:
+    """Loads the dlib models on first use or on a background thread
+
+    Importing this module no longer deserializes the networks. The first
+    access to detector, shape_predictor or face_recognizer loads all three;
+    start_background() does the same off the calling thread, followed by one
+    warm-up inference, and `ready` is set once that has finished.
+
+    A failed load is kept in `error` and raised again by every later access,
+    so a missing model file is read (and reported) once, not on every frame.
+    """
+
+    def __init__(self, landmarks_path=LANDMARKS_MODEL, recognition_path=RECOGNITION_MODEL):
+        self.landmarks_path = landmarks_path
+        self.recognition_path = recognition_path
+        self.ready = threading.Event()
+        self.timings = {}
+        self.error = None
+        self._models = None
+        self._lock = threading.Lock()
+
+    @property
+    def loaded(self):
+        return self._models is not None
+
+    def load(self):
+        """Load every model once, returns (detector, shape_predictor, face_recognizer)"""
+        if self._models is not None:
+            return self._models
+        with self._lock:
+            if self.error is not None:
+                raise RuntimeError(f"Face models failed to load: {self.error}") from self.error
+            if self._models is None:
+                try:
+                    start = time.perf_counter()
+                    detector = dlib.get_frontal_face_detector()
+                    self.timings["detector"] = time.perf_counter() - start
+
+                    start = time.perf_counter()
+                    shape_predictor = dlib.shape_predictor(self.landmarks_path)
+                    self.timings["shape_predictor"] = time.perf_counter() - start
+
+                    start = time.perf_counter()
+                    face_recognizer = dlib.face_recognition_model_v1(self.recognition_path)
+                    self.timings["face_recognizer"] = time.perf_counter() - start
+                except Exception as e:
+                    self.error = e
+                    raise
+                self._models = (detector, shape_predictor, face_recognizer)
+        return self._models
+
+    def warm_up(self):
+        """Run one detection, landmark and embedding pass on a blank frame"""
+        detector, shape_predictor, face_recognizer = self.load()
+        start = time.perf_counter()
+        frame = np.zeros((150, 150, 3), dtype=np.uint8)
+        detector(frame)
+        shape = shape_predictor(frame, dlib.rectangle(0, 0, 149, 149))
+        face_recognizer.compute_face_descriptor(frame, shape)
+        self.timings["warm_up"] = time.perf_counter() - start
+
+    def start_background(self, on_ready=None):
+        """Load and warm up on a daemon thread, then call on_ready(error)"""
+        def run():
+            try:
+                self.warm_up()
+            except Exception as e:
+                if self.error is None:
+                    self.error = e
+            self.ready.set()
+            if on_ready is not None:
+                on_ready(self.error)
+
+        thread = threading.Thread(target=run, name="model-loader", daemon=True)
+        thread.start()
+        return thread
+
+    @property
+    def detector(self):
+        return self.load()[0]
+
+    @property
+    def shape_predictor(self):
+        return self.load()[1]
+
+    @property
+    def face_recognizer(self):
+        return self.load()[2]
+
+
+models = ModelRegistry()
+
+
+class FaceMatch:
+    """One detected face with its landmarks, descriptor and gallery match"""
+
+    def __init__(self, box, shape, descriptor, name, distance, crop):
+        self.box = box
+        self.shape = shape
+        self.descriptor = descriptor
+        self.name = name
+        self.distance = distance
+        self.crop = crop
+
+
+class FaceDetector:
+    """HOG detection on a downscaled copy of the frame, optionally limited to a ROI
+
+    Boxes found at `scale` are mapped back to full resolution for landmarking
+    and embedding. With `roi_margin` set, detection runs only inside the last
+    faces' boxes grown by that fraction of their size, falling back to the
+    full frame when the ROI comes up empty and every `full_interval` calls so
+    new arrivals are not missed.
+    """
+
+    def __init__(self, scale=1.0, upsample=0, roi_margin=None, full_interval=5):
+        self.scale = scale
+        self.upsample = upsample
+        self.roi_margin = roi_margin
+        self.full_interval = full_interval
+        self.last_boxes = []
+        self._calls = 0
+
+    def detect(self, rgb_frame):
+        """Return full-resolution dlib rectangles for every face in an RGB frame"""
+        self._calls += 1
+        if self.roi_margin is not None and self.last_boxes and self._calls % self.full_interval:
+            boxes = self.detect_region(rgb_frame, self.roi(rgb_frame.shape))
+            if boxes:
+                self.last_boxes = boxes
+                return boxes
+        h, w = rgb_frame.shape[:2]
+        self.last_boxes = self.detect_region(rgb_frame, (0, 0, w, h))
+        return self.last_boxes
+
+    def roi(self, frame_shape):
+        """(left, top, right, bottom) around the last boxes, grown by roi_margin"""
+        h, w = frame_shape[:2]
+        left = min(b.left() - int(self.roi_margin * b.width()) for b in self.last_boxes)
+        top = min(b.top() - int(self.roi_margin * b.height()) for b in self.last_boxes)
+        right = max(b.right() + int(self.roi_margin * b.width()) for b in self.last_boxes)
+        bottom = max(b.bottom() + int(self.roi_margin * b.height()) for b in self.last_boxes)
+        return max(left, 0), max(top, 0), min(right, w), min(bottom, h)
+
+    def detect_region(self, rgb_frame, region):
+        left, top, right, bottom = region
+        view = rgb_frame[top:bottom, left:right]
+        if self.scale != 1.0:
+            view = cv2.resize(view, None, fx=self.scale, fy=self.scale, interpolation=cv2.INTER_AREA)
+        else:
+            view = np.ascontiguousarray(view)
+        with stages.measure("detect"):
+            found = models.detector(view, self.upsample)
+        return [dlib.rectangle(int(r.left() / self.scale) + left, int(r.top() / self.scale) + top,
+                               int(r.right() / self.scale) + left, int(r.bottom() / self.scale) + top)
+                for r in found]
+
+
+def crop_face(frame, box):
+    """Cut the face box out of the frame, clipped to the image"""
+    h, w = frame.shape[:2]
+    top, bottom = max(box.top(), 0), min(box.bottom(), h)
+    left, right = max(box.left(), 0), min(box.right(), w)
+    return frame[top:bottom, left:right].copy()
+
+
+def embed_faces(rgb_frame, boxes):
+    """Landmark every face box and embed them in one batched call
+
+    Returns (shapes, descriptors) with descriptors as an (n, 128) matrix.
+    """
+    shapes = dlib.full_object_detections()
+    with stages.measure("landmark"):
+        for box in boxes:
+            shapes.append(models.shape_predictor(rgb_frame, box))
+    if len(shapes) == 0:
+        return [], np.empty((0, 128))
+    with stages.measure("embed"):
+        descriptors = np.array([np.array(d) for d in models.face_recognizer.compute_face_descriptor(rgb_frame, shapes)])
+    return list(shapes), descriptors
+
+
+def analyze_frame(frame, gallery, threshold=0.6, face_detector=None):
+    """Detect, landmark, embed and match every face in a BGR frame"""
+    with stages.measure("bgr2rgb"):
+        rgb_frame = cv2.cvtColor(frame, cv2.COLOR_BGR2RGB)
+    if face_detector:
+        faces = face_detector.detect(rgb_frame)
+    else:
+        with stages.measure("detect"):
+            faces = list(models.detector(rgb_frame))
+    if not faces:
+        return []
+
+    shapes, descriptors = embed_faces(rgb_frame, faces)
+    with stages.measure("match"):
+        matches = gallery.match_many(descriptors, threshold)
+    return [FaceMatch(face, shape, descriptor, name, distance, crop_face(frame, face))
+            for face, shape, descriptor, (name, distance)
+            in zip(faces, shapes, descriptors, matches)]
@@ -0,0 +1,187 @@
+"""Headless recognition of a video file or stream with attendance output
+
+    python recognize_video.py entrance.mp4 --stride 5 --workers 4
+    python recognize_video.py rtsp://camera/stream --start "2025-04-26 08:00:00"
+
+Frames are decoded in a background thread and recognized in a process pool.
+Each person produces one attendance event per cooldown window, and the run
+ends with the achieved real-time factor (seconds of video per second of
+processing).
+"""
+import argparse
+import csv
+import datetime
+import multiprocessing
+import os
+import threading
+import time
+import cv2
+from database import DB_PATH, create_connection
+from descriptor_store import DescriptorStore
+from face_gallery import AGGREGATIONS, MATCH_AGGREGATION
+
+
+def read_frames(source, stride):
+    """Yield (frame_index, frame) for every stride-th frame of a video source"""
+    cap = cv2.VideoCapture(source)
+    if not cap.isOpened():
+        raise SystemExit(f"Cannot open video source: {source}")
+    index = 0
+    try:
+        while True:
+            # grab() skips decoding of frames that are not sampled
+            if not cap.grab():
+                break
+            if index % stride == 0:
+                ret, frame = cap.retrieve()
+                if ret:
+                    yield index, frame
+            index += 1
+    finally:
+        cap.release()
+
+
+def bounded(frames, slots):
+    """Block the decoder while `slots` decoded frames are waiting for inference"""
+    for item in frames:
+        slots.acquire()
+        yield item
+
+
+def video_fps(source, default=30.0):
+    cap = cv2.VideoCapture(source)
+    fps = cap.get(cv2.CAP_PROP_FPS)
+    cap.release()
+    return fps if fps and fps > 0 else default
+
+
+def init_worker(db_path, threshold, scale, upsample, aggregation=MATCH_AGGREGATION):
+    """Load the models and the gallery once per worker process"""
+    global _gallery, _detector, _threshold, _analyze
+    from recognition import FaceDetector, analyze_frame, models
+    models.load()
+    conn = create_connection(db_path)
+    # Every worker maps the same store files, so the gallery pages are shared
+    _gallery = DescriptorStore(db_path).load_gallery(conn)
+    # Per person like the GUI and the model server, so the same footage gets the same names
+    _gallery.set_aggregation(aggregation)
+    conn.close()
+    _detector = FaceDetector(scale, upsample)
+    _threshold = threshold
+    _analyze = analyze_frame
+
+
+def recognize(item):
+    """Return (frame_index, [(name, distance), ...]) for one frame"""
+    index, frame = item
+    faces = _analyze(frame, _gallery, _threshold, face_detector=_detector)
+    return index, [(face.name, face.distance) for face in faces]
+
+
+class AttendanceEvents:
+    """Turns per-frame recognitions into one event per person per cooldown window"""
+
+    def __init__(self, cooldown):
+        self.cooldown = cooldown
+        self.last_seen = {}
+        self.events = []
+
+    def observe(self, name, video_seconds):
+        last = self.last_seen.get(name)
+        self.last_seen[name] = video_seconds
+        if last is None or video_seconds - last > self.cooldown:
+            self.events.append((name, video_seconds))
+            return True
+        return False
+
+
+def run(source, db_path=DB_PATH, stride=5, workers=None, threshold=0.6, scale=1.0, upsample=0,
+        cooldown=60.0, start_time=None, output=None, aggregation=MATCH_AGGREGATION):
+    fps = video_fps(source)
+    events = AttendanceEvents(cooldown)
+    workers = workers or os.cpu_count() or 1
+    frames = 0
+    last_index = 0
+    slots = threading.Semaphore(workers * 4)
+    # Export a stale descriptor store once here rather than in every worker
+    conn = create_connection(db_path)
+    DescriptorStore(db_path).refresh(conn)
+    conn.close()
+
+    start = time.perf_counter()
+    with multiprocessing.Pool(workers, initializer=init_worker,
+                              initargs=(db_path, threshold, scale, upsample, aggregation)) as pool:
+        # imap pulls frames from the decoder generator in its own feeder thread
+        for index, faces in pool.imap(recognize, bounded(read_frames(source, stride), slots), chunksize=2):
+            slots.release()
+            frames += 1
+            last_index = index
+            seconds = index / fps
+            for name, _ in faces:
+                if name and events.observe(name, seconds):
+                    print(f"  {format_time(seconds, start_time)}  {name}")
+    elapsed = time.perf_counter() - start
+
+    video_seconds = (last_index + 1) / fps if frames else 0.0
+    if output:
+        write_events(output, events.events, start_time)
+    return {
+        "frames": frames,
+        "video_seconds": video_seconds,
+        "seconds": elapsed,
+        "frames_per_second": frames / elapsed if elapsed else 0.0,
+        "realtime_factor": video_seconds / elapsed if elapsed else 0.0,
+        "events": len(events.events),
+        "people": len(events.last_seen),
+    }
+
+
+def format_time(seconds, start_time=None):
+    if start_time is not None:
+        return (start_time + datetime.timedelta(seconds=seconds)).strftime("%Y-%m-%d %H:%M:%S")
+    return str(datetime.timedelta(seconds=int(seconds)))
+
+
+def write_events(path, events, start_time=None):
+    directory = os.path.dirname(path)
+    if directory and not os.path.exists(directory):
+        os.makedirs(directory)
+    with open(path, mode="w", newline="") as file:
+        writer = csv.writer(file)
+        writer.writerow(["Name", "Timestamp", "VideoSeconds"])
+        for name, seconds in events:
+            writer.writerow([name, format_time(seconds, start_time), f"{seconds:.2f}"])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recognize faces in a video file or stream without the GUI")
+    parser.add_argument("source", help="video file path or stream URL")
+    parser.add_argument("--db", default=DB_PATH, help="users database")
+    parser.add_argument("--stride", type=int, default=5, help="recognize every Nth frame")
+    parser.add_argument("--workers", type=int, default=None, help="inference processes (default: CPU count)")
+    parser.add_argument("--threshold", type=float, default=0.6, help="match distance threshold")
+    parser.add_argument("--scale", type=float, default=1.0, help="detection downscale factor")
+    parser.add_argument("--upsample", type=int, default=0, help="HOG upsampling passes")
+    parser.add_argument("--aggregation", choices=list(AGGREGATIONS) + ["none"], default=MATCH_AGGREGATION or "none",
+                        help="match per person over their exemplars, none for the closest row")
+    parser.add_argument("--cooldown", type=float, default=60.0, help="seconds before a person is logged again")
+    parser.add_argument("--start", default=None, help="wall-clock time of the first frame, YYYY-MM-DD HH:MM:SS")
+    parser.add_argument("--output", default=None, help="attendance CSV (default: attendance/video_<name>.csv)")
+    args = parser.parse_args()
+
+    start_time = datetime.datetime.strptime(args.start, "%Y-%m-%d %H:%M:%S") if args.start else None
+    output = args.output
+    if output is None:
+        stem = os.path.splitext(os.path.basename(args.source.rstrip("/")))[0] or "stream"
+        output = os.path.join("attendance", f"video_{stem}.csv")
+
+    summary = run(args.source, args.db, args.stride, args.workers, args.threshold, args.scale,
+                  args.upsample, args.cooldown, start_time, output,
+                  None if args.aggregation == "none" else args.aggregation)
+    print(f"{summary['frames']} frames ({summary['video_seconds']:.1f}s of video) in {summary['seconds']:.1f}s, "
+          f"{summary['frames_per_second']:.1f} frames/s, real-time factor {summary['realtime_factor']:.2f}x")
+    print(f"{summary['events']} attendance events for {summary['people']} people written to {output}")
+
+
+if __name__ == "__main__":
+    main()
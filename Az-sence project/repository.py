@@ -0,0 +1,194 @@
+import queue
+import threading
+from concurrent.futures import Future
+from database import DB_PATH, create_connection, insert_user, read_only_connection, users_generation
+from perf_stats import stages
+
+_repositories = {}
+_repositories_lock = threading.Lock()
+
+
+def open_repository(db_path=DB_PATH):
+    """The process-wide repository of db_path, created (and migrated) on first use"""
+    with _repositories_lock:
+        repository = _repositories.get(db_path)
+        if repository is None:
+            repository = _repositories[db_path] = Repository(db_path)
+        return repository
+
+
+class Repository:
+    """Single writer thread and per-thread read-only connections to the users database
+
+    Writes are functions of the writer connection queued with write(), each
+    returning a Future. The writer drains whatever is queued, up to
+    batch_size, runs each write in its own savepoint so one failure does not
+    undo the others, and commits the batch once. A burst of writes (burst
+    enrollment, attendance flushes, pruning) therefore costs one commit, and
+    the commit happens off the GUI and camera threads.
+
+    Reads use reader(): a read-only connection opened once per thread. With
+    WAL they never wait for the writer and always see the last commit.
+    """
+
+    def __init__(self, db_path=DB_PATH, batch_size=100):
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.commits = 0
+        self._writes = queue.Queue()
+        self._local = threading.local()
+        self._readers = []
+        self._readers_lock = threading.Lock()
+        self._ready = threading.Event()
+        self._error = None
+        self._thread = threading.Thread(target=self._run, name="db-writer", daemon=True)
+        self._thread.start()
+        # Readers are read-only, so the writer has to create or migrate the schema first
+        self._ready.wait()
+        if self._error is not None:
+            raise self._error
+
+    def reader(self):
+        """Read-only connection of the calling thread"""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = self._local.conn = read_only_connection(self.db_path)
+            with self._readers_lock:
+                self._readers.append(conn)
+        return conn
+
+    def write(self, fn, *args):
+        """Queue fn(conn, *args) for the writer thread, returns a Future of its result"""
+        future = Future()
+        self._writes.put((fn, args, future))
+        return future
+
+    def close(self):
+        """Commit the queued writes, stop the writer and close every connection"""
+        self._writes.put(None)
+        self._thread.join()
+        with self._readers_lock:
+            for conn in self._readers:
+                conn.close()
+            self._readers = []
+        with _repositories_lock:
+            if _repositories.get(self.db_path) is self:
+                del _repositories[self.db_path]
+
+    # Users and accounts
+
+    def add_user(self, name, descriptor, image, created_at):
+        """Future of (user id, generation before, generation after)"""
+        return self.write(_users_change, _insert_user, name, descriptor, image, created_at)
+
+    def remove_id(self, user_id):
+        return self.write(_users_change, _execute, "DELETE FROM users WHERE id = ?", user_id)
+
+    def remove_name(self, name):
+        return self.write(_users_change, _execute, "DELETE FROM users WHERE name = ?", name)
+
+    def rename(self, old_name, new_name):
+        return self.write(_users_change, _execute, "UPDATE users SET name = ? WHERE name = ?", new_name, old_name)
+
+    def add_account(self, username, password, role):
+        """Future of False when the username is already taken"""
+        return self.write(_insert_account, username, password, role)
+
+    def add_attendance(self, rows):
+        return self.write(_insert_attendance, rows)
+
+    def find_account(self, username, password):
+        return self.reader().execute("SELECT * FROM accounts WHERE username = ? AND password = ?",
+                                     (username, password)).fetchone()
+
+    def face_image(self, user_id):
+        row = self.reader().execute("SELECT image FROM face_images WHERE user_id = ?", (user_id,)).fetchone()
+        return row[0] if row is not None else None
+
+    def _run(self):
+        try:
+            conn = create_connection(self.db_path)
+        except Exception as e:
+            self._error = e
+            self._ready.set()
+            return
+        self._ready.set()
+        stopping = False
+        while not stopping:
+            batch = [self._writes.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._writes.get_nowait())
+                except queue.Empty:
+                    break
+            if None in batch:
+                stopping = True
+                batch = [task for task in batch if task is not None]
+                while True:
+                    try:
+                        task = self._writes.get_nowait()
+                    except queue.Empty:
+                        break
+                    if task is not None:
+                        batch.append(task)
+            if batch:
+                self._commit(conn, batch)
+        conn.close()
+
+    def _commit(self, conn, batch):
+        outcomes = []
+        with stages.measure("db_write"):
+            try:
+                conn.execute("BEGIN")
+                for fn, args, future in batch:
+                    conn.execute("SAVEPOINT write")
+                    try:
+                        outcomes.append((future, fn(conn, *args), None))
+                        conn.execute("RELEASE write")
+                    except Exception as e:
+                        conn.execute("ROLLBACK TO write")
+                        conn.execute("RELEASE write")
+                        outcomes.append((future, None, e))
+                conn.commit()
+            except Exception as e:
+                conn.rollback()
+                outcomes = [(future, None, e) for _, _, future in batch]
+        self.commits += 1
+        stages.count("db_commits")
+        stages.count("db_writes", len(batch))
+        # Results are only handed out once they are durable
+        for future, value, error in outcomes:
+            if error is None:
+                future.set_result(value)
+            else:
+                future.set_exception(error)
+
+
+def _users_change(conn, fn, *args):
+    """Run a users write, returns (its result, users generation before, after)
+
+    The generations feed the descriptor store log, and are read inside the
+    write's own savepoint so other writes of the batch cannot interleave.
+    """
+    before = users_generation(conn)
+    value = fn(conn, *args)
+    return value, before, users_generation(conn)
+
+
+def _insert_user(conn, *args):
+    return insert_user(conn.cursor(), *args)
+
+
+def _execute(conn, sql, *params):
+    return conn.execute(sql, params).rowcount
+
+
+def _insert_account(conn, username, password, role):
+    if conn.execute("SELECT 1 FROM accounts WHERE username = ?", (username,)).fetchone():
+        return False
+    conn.execute("INSERT INTO accounts (username, password, role) VALUES (?, ?, ?)", (username, password, role))
+    return True
+
+
+def _insert_attendance(conn, rows):
+    conn.executemany("INSERT INTO attendance (name, timestamp, date) VALUES (?, ?, ?)", rows)
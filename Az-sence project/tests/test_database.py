@@ -0,0 +1,93 @@
+import sqlite3
+import numpy as np
+import pytest
+import database
+from database import SCHEMA_VERSION, create_connection, decode_descriptors, schema_version, table_columns
+
+
+def make_v1_database(path, rows):
+    """Database in the layout of the first release: one keyless users table"""
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE users (name TEXT, descriptor BLOB, image BLOB, created_at TEXT)")
+    conn.execute("CREATE TABLE accounts (username TEXT PRIMARY KEY, password TEXT, role TEXT)")
+    conn.executemany("INSERT INTO users (name, descriptor, image, created_at) VALUES (?, ?, ?, ?)", rows)
+    conn.commit()
+    conn.close()
+
+
+def legacy_rows(n, seed=0):
+    rng = np.random.default_rng(seed)
+    descriptors = rng.normal(0.0, 0.1, (n, 128))
+    return descriptors, [(f"person_{i}", descriptors[i].tobytes(), b"jpeg%d" % i, "2024-01-01 08:00:00")
+                         for i in range(n)]
+
+
+def test_migrates_v1_rows_keeping_rowids_and_images(tmp_path):
+    path = str(tmp_path / "users.db")
+    descriptors, rows = legacy_rows(3)
+    make_v1_database(path, rows)
+
+    conn = create_connection(path)
+    assert schema_version(conn) == SCHEMA_VERSION
+    assert not table_columns(conn, "users_v1")
+    users = conn.execute("SELECT id, name, descriptor, descriptor_dim FROM users ORDER BY id").fetchall()
+    assert [(u[0], u[1], u[3]) for u in users] == [(1, "person_0", 128), (2, "person_1", 128), (3, "person_2", 128)]
+    np.testing.assert_allclose(decode_descriptors([u[2] for u in users], 128), descriptors, rtol=1e-6)
+    assert conn.execute("SELECT user_id, image FROM face_images WHERE user_id = 2").fetchone() == (2, b"jpeg1")
+    conn.close()
+
+
+def test_skips_rows_without_a_valid_descriptor(tmp_path, caplog):
+    path = str(tmp_path / "users.db")
+    _, rows = legacy_rows(2)
+    rows += [("no_descriptor", None, b"jpeg", "2024-01-01 08:00:00"),
+             ("truncated", b"\x00" * 12, None, "2024-01-01 08:00:00")]
+    make_v1_database(path, rows)
+
+    conn = create_connection(path)
+    names = [row[0] for row in conn.execute("SELECT name FROM users ORDER BY id")]
+    assert names == ["person_0", "person_1"]
+    assert "no_descriptor" in caplog.text and "truncated" in caplog.text
+    conn.close()
+
+
+def test_failed_migration_leaves_the_v1_database_untouched(tmp_path, monkeypatch):
+    path = str(tmp_path / "users.db")
+    _, rows = legacy_rows(2)
+    make_v1_database(path, rows)
+
+    def fail(conn):
+        raise RuntimeError("interrupted")
+    monkeypatch.setattr(database, "migrate_v3", fail)
+    with pytest.raises(RuntimeError):
+        create_connection(path)
+
+    conn = sqlite3.connect(path)
+    assert schema_version(conn) == 0
+    assert "id" not in table_columns(conn, "users")
+    assert not table_columns(conn, "users_v1")
+    assert conn.execute("SELECT COUNT(*) FROM users").fetchone()[0] == 2
+    conn.close()
+
+    monkeypatch.undo()
+    conn = create_connection(path)
+    assert conn.execute("SELECT COUNT(*) FROM users").fetchone()[0] == 2
+    conn.close()
+
+
+def test_resumes_a_users_v1_table_left_by_an_interrupted_migration(tmp_path):
+    path = str(tmp_path / "users.db")
+    _, rows = legacy_rows(2)
+    # What a non-atomic migration left behind: the current schema and version, an empty users table
+    # and the renamed version 1 table still holding every row
+    create_connection(path).close()
+    conn = sqlite3.connect(path)
+    conn.execute("CREATE TABLE users_v1 (name TEXT, descriptor BLOB, image BLOB, created_at TEXT)")
+    conn.executemany("INSERT INTO users_v1 (name, descriptor, image, created_at) VALUES (?, ?, ?, ?)", rows)
+    conn.commit()
+    conn.close()
+
+    conn = create_connection(path)
+    assert [row[0] for row in conn.execute("SELECT name FROM users ORDER BY id")] == ["person_0", "person_1"]
+    assert not table_columns(conn, "users_v1")
+    conn.close()
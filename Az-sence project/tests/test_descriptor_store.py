@@ -0,0 +1,102 @@
+import numpy as np
+import pytest
+from database import create_connection, insert_user, users_generation
+from descriptor_store import STORE_DTYPE, DescriptorStore
+
+
+def add_user(conn, name, descriptor):
+    before = users_generation(conn)
+    user_id = insert_user(conn.cursor(), name, descriptor, None, "2024-01-01 08:00:00")
+    conn.commit()
+    return user_id, before, users_generation(conn)
+
+
+def make_database(path, n, seed=0):
+    conn = create_connection(path)
+    rng = np.random.default_rng(seed)
+    for i in range(n):
+        add_user(conn, f"person_{i}", rng.normal(0.0, 0.1, 128))
+    return conn
+
+
+def manifest_version(store):
+    return store._read_manifest()["version"]
+
+
+def log_changes(conn, store):
+    """Add, rename and remove users, logging each change to store"""
+    descriptor = np.full(128, 0.05)
+    user_id, before, after = add_user(conn, "newcomer", descriptor)
+    store.append(conn, before, after, "add", user_id, "newcomer", descriptor)
+    before = users_generation(conn)
+    conn.execute("UPDATE users SET name = ? WHERE name = ?", ("renamed", "person_0"))
+    conn.commit()
+    store.append(conn, before, users_generation(conn), "rename", "person_0", "renamed")
+    before = users_generation(conn)
+    conn.execute("DELETE FROM users WHERE name = ?", ("person_1",))
+    conn.commit()
+    store.append(conn, before, users_generation(conn), "remove_name", "person_1")
+
+
+def assert_matches_users(gallery, conn):
+    assert sorted(gallery.names) == ["newcomer", "person_2", "renamed"]
+    stored = conn.execute("SELECT id FROM users ORDER BY id").fetchall()
+    assert sorted(gallery.ids.tolist()) == [row[0] for row in stored]
+
+
+@pytest.fixture
+def logged_store(tmp_path):
+    path = str(tmp_path / "users.db")
+    conn = make_database(path, 3)
+    store = DescriptorStore(path)
+    store.export(conn)
+    log_changes(conn, store)
+    yield path, conn
+    conn.close()
+
+
+def test_folds_a_logged_store_and_keeps_it_mapped(logged_store):
+    path, conn = logged_store
+    reopened = DescriptorStore(path)
+    gallery = reopened.load_gallery(conn)
+    assert manifest_version(reopened) == 2
+    assert reopened.log_entries == 0
+    assert isinstance(gallery.descriptors, np.memmap)
+    assert_matches_users(gallery, conn)
+
+
+def test_replays_the_log_when_the_store_cannot_be_written(logged_store, monkeypatch):
+    path, conn = logged_store
+    reopened = DescriptorStore(path)
+
+    def read_only(conn):
+        raise PermissionError("read-only store")
+    monkeypatch.setattr(reopened, "export", read_only)
+    gallery = reopened.load_gallery(conn)
+    assert manifest_version(reopened) == 1
+    assert reopened.log_entries == 3
+    assert_matches_users(gallery, conn)
+
+
+def test_exports_again_when_the_generation_does_not_match(tmp_path):
+    path = str(tmp_path / "users.db")
+    conn = make_database(path, 2)
+    store = DescriptorStore(path)
+    store.export(conn)
+    # Enrolled by another process that does not log to the store
+    add_user(conn, "unlogged", np.zeros(128))
+
+    gallery = store.load_gallery(conn)
+    assert manifest_version(store) == 2
+    assert store.log_entries == 0
+    assert sorted(gallery.names) == ["person_0", "person_1", "unlogged"]
+    conn.close()
+
+
+def test_maps_the_descriptors_without_copying(tmp_path):
+    path = str(tmp_path / "users.db")
+    conn = make_database(path, 2)
+    gallery = DescriptorStore(path).load_gallery(conn)
+    assert gallery.descriptors.dtype == STORE_DTYPE
+    assert isinstance(gallery.descriptors, np.memmap)
+    conn.close()